@@ -0,0 +1,153 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Action plugin running the SNS modules inside the controller worker.
+
+The modules only talk to the appliances over HTTPS, so when the task is
+executed locally (delegate_to: localhost or connection: local) the module
+main() is called in-process with the same arguments and return shape,
+which saves the AnsiballZ packaging, the temporary directory and the
+interpreter startup of each task.
+
+The same file is used for sns_command, sns_facts, sns_getconf and
+sns_object_import. Set the sns_in_process variable to false to run the
+modules as usual.
+
+Tasks with broker or detach set are always run as usual: both fork a
+background process, which must not be a copy of the controller worker.
+
+For sns_facts with max_age, the sns_facts variable of the host (ie: loaded
+from the fact cache) is passed to the module which returns it unchanged
+while it is fresh.
+'''
+
+import io
+import json
+import os
+import sys
+import traceback
+
+import ansible.module_utils
+import ansible.module_utils.basic as basic
+from ansible import constants as C
+from ansible.module_utils.common.text.converters import to_bytes
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.display import Display
+
+display = Display()
+
+
+def _add_module_utils_paths(module_path):
+    '''
+    make the custom module_utils importable as ansible.module_utils.*
+    '''
+    paths = [os.path.join(os.path.dirname(os.path.dirname(module_path)), 'module_utils')]
+    paths.extend(C.DEFAULT_MODULE_UTILS_PATH or [])
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path) and path not in ansible.module_utils.__path__:
+            ansible.module_utils.__path__.append(path)
+
+
+def _load_module(name, module_path):
+    '''
+    returns the python module of an ansible module, loaded once per worker
+    '''
+    key = "ansible_sns_in_process_{}".format(name)
+    if key in sys.modules:
+        return sys.modules[key]
+    _add_module_utils_paths(module_path)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(key, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[key] = module
+    return module
+
+
+def _run_main(module, args):
+    '''
+    run the module main() as AnsiballZ would, returns the module result
+    '''
+    stdout = sys.stdout
+    buf = io.StringIO()
+    basic._ANSIBLE_ARGS = to_bytes(json.dumps({'ANSIBLE_MODULE_ARGS': args}))
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        # ansible-core >= 2.19 also expects the JSON serialization profile
+        basic._ANSIBLE_PROFILE = 'legacy'
+    sys.stdout = buf
+    try:
+        module.main()
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout = stdout
+        basic._ANSIBLE_ARGS = None
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            basic._ANSIBLE_PROFILE = None
+    return json.loads(buf.getvalue())
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+
+    def _in_process(self, task_vars, args):
+        if not boolean(task_vars.get('sns_in_process', True), strict=False):
+            return False
+        # the session broker and the detached jobs are spawned by fork
+        if any(boolean(args.get(name, False), strict=False) for name in ('broker', 'detach')):
+            return False
+        # remote execution keeps the module semantics (ie: local file of CONFIG BACKUP)
+        return getattr(self._connection, 'transport', None) == 'local'
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        name = self._task.action.split('.')[-1]
+        args = dict(self._task.args)
+        if name == 'sns_facts' and args.get('max_age') is not None and 'cached_facts' not in args:
+            if task_vars.get('sns_facts'):
+                args['cached_facts'] = task_vars['sns_facts']
+
+        module_path = None
+        if self._in_process(task_vars, args):
+            module_path = self._shared_loader_obj.module_loader.find_plugin(name, mod_type='.py')
+
+        if module_path is None:
+            result.update(self._execute_module(module_name=name, module_args=args, task_vars=task_vars))
+            return result
+
+        args.update({
+            '_ansible_module_name': name,
+            '_ansible_check_mode': self._play_context.check_mode,
+            '_ansible_no_log': self._play_context.no_log,
+            '_ansible_diff': self._play_context.diff,
+            '_ansible_verbosity': display.verbosity,
+        })
+
+        try:
+            module = _load_module(name, module_path)
+            result.update(_run_main(module, args))
+        except Exception as exception:
+            result['failed'] = True
+            result['msg'] = "In-process execution of {} failed: {}".format(name, str(exception))
+            result['exception'] = traceback.format_exc()
+        return result
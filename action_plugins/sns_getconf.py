@@ -0,0 +1 @@
+sns_command.py
\ No newline at end of file
@@ -0,0 +1,300 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Local stand-in of the SNS HTTPS API for benchmarks.
+
+MockServer speaks the subset of the protocol used by SSLClient: the
+authentication (/auth/admin.html, /api/auth/login, /api/auth/logout), the
+commands (/api/command) and the file transfers (/api/upload,
+/api/download/tmp.file). It answers SYSTEM PROPERTY, HA INFO, the NTP, DNS and
+webadmin lists, CONFIG OBJECT LIST with a configurable number of objects,
+CONFIG BACKUP and the CONFIG OBJECT IMPORT sequence, whose status is PENDING
+for a configurable number of polls before OK. Any other command succeeds with
+an empty result.
+
+A latency in seconds is added to each command, per command prefix or by default.
+'''
+
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from xml.sax.saxutils import quoteattr
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+from stormshield.sns import crc as snscrc
+
+OK = ('100', '00a00100', 'Ok')
+ERROR = ('200', '00500100', 'Error')
+WAIT_UPLOAD = ('102', '00a00300', 'Waiting for upload')
+WAIT_DOWNLOAD = ('101', '00a01c00', 'Begin download')
+BEGIN = ('101', '00a01000', 'Begin')
+
+
+def serverd(status, content=""):
+    (ret, code, msg) = status
+    return '<serverd ret="{}" code="{}" msg="{}">{}</serverd>'.format(ret, code, msg, content)
+
+
+def nws(*nodes):
+    return '<?xml version="1.0"?><nws code="100" msg="OK">{}</nws>'.format("".join(nodes))
+
+
+def keys(row):
+    return "".join('<key name={} value={}/>'.format(quoteattr(str(name)), quoteattr(str(value)))
+                   for (name, value) in row.items())
+
+
+def reply(data_format=None, sections=None, status=OK):
+    '''
+    returns a command reply, sections is a list of (title, content) where content is a dict
+    for the section format, a list of dict for section_line and a list of str for list
+    '''
+    if data_format is None:
+        return nws(serverd(status))
+    body = []
+    for (title, content) in sections:
+        if data_format == 'section':
+            body.append('<section title={}>{}</section>'.format(quoteattr(title), keys(content)))
+        elif data_format == 'section_line':
+            body.append('<section title={}>{}</section>'.format(
+                quoteattr(title), "".join('<line>{}</line>'.format(keys(row)) for row in content)))
+        else:
+            body.append('<section title={}>{}</section>'.format(
+                quoteattr(title), "".join('<line>{}</line>'.format(line) for line in content)))
+    return nws(serverd(BEGIN, '<data format="{}">{}</data>'.format(data_format, "".join(body))),
+               serverd(status))
+
+
+def objects(count):
+    '''
+    returns count host objects as CONFIG OBJECT LIST rows
+    '''
+    return [{"type": "host", "name": "host{}".format(index),
+             "ip": "10.{}.{}.{}".format((index >> 16) & 255, (index >> 8) & 255, index & 255),
+             "comment": "benchmark object {}".format(index)}
+            for index in range(count)]
+
+
+class MockState(object):
+
+    def __init__(self, objects=1000, pending_polls=3, latency=0.0, latencies=None, backup_size=65536):
+        self.objects = objects
+        self.pending_polls = pending_polls
+        self.latency = latency
+        self.latencies = dict((prefix.upper(), delay) for (prefix, delay) in (latencies or {}).items())
+        self.backup = os.urandom(backup_size)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.polls = 0
+        self.counters = {"auth": 0, "commands": 0, "uploads": 0, "downloads": 0,
+                         "bytes_received": 0, "bytes_sent": 0}
+        self._object_reply = None
+
+    def delay(self, command):
+        for (prefix, delay) in self.latencies.items():
+            if command.upper().startswith(prefix):
+                return delay
+        return self.latency
+
+    def object_reply(self):
+        if self._object_reply is None:
+            self._object_reply = reply('section_line', [("Object", objects(self.objects))])
+        return self._object_reply
+
+    def command(self, command):
+        '''
+        returns the XML reply to a command
+        '''
+        words = command.upper().split()
+        name = " ".join(words[:3])
+        if name == "SYSTEM PROPERTY":
+            return reply('section', [("Result", {
+                "Model": "V50-A", "Version": "4.3.0", "SerialNumber": "V50XXA0000000",
+                "Name": "mock", "Type": "Firewall", "MachineType": "amd64"})])
+        if name == "HA INFO":
+            return reply(status=ERROR)
+        if name == "CONFIG NTP SERVER":
+            return reply('section_line', [("Result", [
+                {"name": "fr.pool.ntp.org", "keynum": "none", "type": "host"}])])
+        if name == "CONFIG DNS SERVER":
+            return reply('section', [("Server", {"dns1": "dns1", "dns2": "dns2"})])
+        if name == "CONFIG WEBADMIN ACCESS":
+            return reply('list', [("Result", ["any"])])
+        if name == "CONFIG OBJECT LIST":
+            return self.object_reply()
+        if name == "CONFIG OBJECT IMPORT":
+            action = words[3] if len(words) > 3 else ""
+            if action == "UPLOAD":
+                return nws(serverd(WAIT_UPLOAD))
+            if action == "ACTIVATE":
+                with self.lock:
+                    self.polls = 0
+            if action == "STATUS":
+                with self.lock:
+                    self.polls += 1
+                    status = "PENDING" if self.polls <= self.pending_polls else "OK"
+                return reply('section', [("Result", {"Status": status, "Code": "0",
+                                                     "Num_line": "0", "host": "0"})])
+            return reply()
+        if name.startswith("CONFIG BACKUP"):
+            return nws(serverd(WAIT_DOWNLOAD, '<data format="raw"><crc>{:X}</crc><size>{}</size></data>'.format(
+                snscrc.compute_crc32(self.backup), len(self.backup))))
+        return reply()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_xml(self, body, cookie=None):
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(payload)))
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.state.counters['bytes_sent'] += len(payload)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        self.server.state.counters['bytes_received'] += length
+
+    def do_POST(self):
+        state = self.server.state
+        path = urlparse(self.path).path
+        self.read_body()
+        if path == "/auth/admin.html":
+            state.counters['auth'] += 1
+            self.send_xml('<?xml version="1.0"?><nws code="100" msg="AUTH_SUCCESS"/>',
+                          cookie="NETASQ_sslclient=mock; Path=/")
+        elif path == "/api/auth/login":
+            session = "mock{}".format(state.counters['auth'])
+            state.sessions.add(session)
+            self.send_xml('<?xml version="1.0"?><nws code="100" msg="OK"><sessionid>{}</sessionid>'
+                          '<protocol>1</protocol><sessionlevel>modify,base</sessionlevel></nws>'.format(session))
+        elif path == "/api/upload":
+            state.counters['uploads'] += 1
+            self.send_xml(reply())
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/api/auth/logout":
+            state.sessions.discard(query.get('sessionid', [""])[0])
+            self.send_xml(reply())
+        elif url.path == "/api/command":
+            command = query.get('cmd', [""])[0]
+            state.counters['commands'] += 1
+            delay = state.delay(command)
+            if delay:
+                time.sleep(delay)
+            self.send_xml(state.command(command))
+        elif url.path == "/api/download/tmp.file":
+            state.counters['downloads'] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(state.backup)))
+            self.end_headers()
+            self.wfile.write(state.backup)
+            state.counters['bytes_sent'] += len(state.backup)
+        else:
+            self.send_error(404)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockServer(object):
+    '''
+    HTTPS mock server on a free local port, with a self-signed certificate
+    generated by openssl. Use as a context manager.
+    '''
+
+    def __init__(self, **options):
+        self.state = MockState(**options)
+        self.folder = None
+        self.cert = None
+        self.server = None
+
+    def _certificate(self):
+        self.folder = tempfile.mkdtemp(prefix="sns-mock-")
+        cert = os.path.join(self.folder, "cert.pem")
+        key = os.path.join(self.folder, "key.pem")
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                               "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                               "-keyout", key, "-out", cert],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return cert, key
+
+    def start(self):
+        (self.cert, key) = self._certificate()
+        self.server = ThreadingServer(("127.0.0.1", 0), MockHandler)
+        self.server.state = self.state
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert, key)
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+    @property
+    def appliance(self):
+        '''
+        connection parameters of the mock server, as expected by the modules
+        '''
+        return {"host": "127.0.0.1", "port": self.server.server_address[1], "user": "admin",
+                "password": "mock", "cabundle": self.cert}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
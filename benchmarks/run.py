@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Benchmarks of the SNS modules against the local mock server.
+
+The modules are run in-process, as the action plugin does, except for the
+startup benchmark which runs sns_command in a fresh interpreter with the
+SNS_STARTUP_TRACE measurement of the client factory. Each benchmark records the
+duration of its iterations. Results are written to a JSON file and
+can be compared to a previous result file, the script exits with status 1 when
+the median duration of a benchmark exceeds the baseline by more than the
+tolerance.
+
+    python3 benchmarks/run.py --output results.json
+    python3 benchmarks/run.py --baseline results.json --tolerance 0.25
+'''
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ansible.module_utils
+import ansible.module_utils.basic as basic
+
+from stormshield.sns.sslclient import SSLClient
+
+from mock_server import MockServer
+
+MODULES = {}
+
+
+def load_module(name):
+    '''
+    returns the python module of an ansible module of the library folder
+    '''
+    if name not in MODULES:
+        path = os.path.join(ROOT, "module_utils")
+        if path not in ansible.module_utils.__path__:
+            ansible.module_utils.__path__.append(path)
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("sns_benchmark_" + name,
+                                                      os.path.join(ROOT, "library", name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        MODULES[name] = module
+    return MODULES[name]
+
+
+def run_module(name, args):
+    '''
+    runs the module main() and returns its result and the size of its JSON output
+    '''
+    module = load_module(name)
+    stdout = sys.stdout
+    buf = io.StringIO()
+    basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        # ansible-core >= 2.19 also expects the JSON serialization profile
+        basic._ANSIBLE_PROFILE = 'legacy'
+    sys.stdout = buf
+    try:
+        module.main()
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout = stdout
+        basic._ANSIBLE_ARGS = None
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            basic._ANSIBLE_PROFILE = None
+    output = buf.getvalue()
+    result = json.loads(output)
+    if result.get('failed'):
+        raise Exception("{} failed: {}".format(name, result.get('msg')))
+    return result, len(output)
+
+
+def measure(iterations, function):
+    '''
+    returns the duration statistics of the iterations and the metrics of the last one
+    '''
+    durations = []
+    metrics = {}
+    for _ in range(iterations):
+        start = time.time()
+        metrics = function() or {}
+        durations.append(time.time() - start)
+    stats = {
+        "iterations": iterations,
+        "min": round(min(durations), 6),
+        "median": round(statistics.median(durations), 6),
+        "mean": round(statistics.mean(durations), 6),
+        "max": round(max(durations), 6),
+    }
+    stats.update(metrics)
+    return stats
+
+
+def bench_connect(server, params, folder):
+    def connect():
+        client = SSLClient(autoconnect=False, **server.appliance)
+        client.connect()
+        client.disconnect()
+    return {"connect_auth": measure(params.iterations, connect)}
+
+
+def bench_command(server, params, folder):
+    def command():
+        (result, size) = run_module("sns_command", {"appliance": server.appliance,
+                                                    "command": "SYSTEM PROPERTY", "timings": True})
+        return {"output_bytes": size, "connect": result['timings']['connect'],
+                "auth": result['timings']['auth']}
+    return {"command": measure(params.iterations, command)}
+
+
+def bench_script(server, params, folder):
+    lines = ["MODIFY FORCE ON"]
+    for index in range(params.script_commands):
+        lines.append('CONFIG OBJECT HOST NEW name=bench{0} ip=192.168.{1}.{2} update=1'.format(
+            index, (index >> 8) & 255, index & 255))
+        lines.append("CONFIG OBJECT ACTIVATE")
+    script = "\n".join(lines)
+    results = {}
+    for (name, options) in [("script", {"keep_results": "all"}),
+                            ("script_coalesced", {"keep_results": "all", "coalesce_activations": True}),
+                            ("script_failed_only", {"keep_results": "failed", "keep_output": False})]:
+        def run(options=options):
+            args = {"appliance": server.appliance, "script": script}
+            args.update(options)
+            (result, size) = run_module("sns_command", args)
+            return {"commands": len(lines), "output_bytes": size}
+        results[name] = measure(params.iterations, run)
+        results[name]['commands_per_second'] = round(len(lines) / results[name]['median'], 1)
+    return results
+
+
+def bench_large_result(server, params, folder):
+    command = "CONFIG OBJECT LIST TYPE=all usage=any"
+    results = {}
+    for (name, options) in [("large_result", {}),
+                            ("large_result_projected", {"sections": ["Object"], "fields": ["name"],
+                                                        "keep_result": False}),
+                            ("large_result_data_file", {"data_file": os.path.join(folder, "objects.jsonl")})]:
+        def run(options=options):
+            args = {"appliance": server.appliance, "command": command}
+            args.update(options)
+            (result, size) = run_module("sns_command", args)
+            return {"objects": params.objects, "output_bytes": size}
+        results[name] = measure(params.iterations, run)
+    return results
+
+
+def bench_getconf(server, params, folder):
+    client = SSLClient(autoconnect=False, **server.appliance)
+    client.connect()
+    output = client.send_command("CONFIG OBJECT LIST TYPE=all usage=any").output
+    client.disconnect()
+
+    def run():
+        (result, size) = run_module("sns_getconf", {
+            "result": output,
+            "queries": [{"name": "first", "section": "Object", "line": 1, "token": "name"},
+                        {"name": "last", "section": "Object", "line": params.objects, "token": "name"}]})
+        return {"objects": params.objects, "output_bytes": size}
+    return {"getconf": measure(params.iterations, run)}
+
+
+def bench_object_import(server, params, folder):
+    path = os.path.join(folder, "objects.csv")
+    with io.open(path, 'w', encoding='utf-8') as target:
+        target.write(u"#type,name,ip,comment\n")
+        for index in range(params.import_lines):
+            # the mock server already knows the objects with an even index
+            comment = "benchmark object {}".format(index) if index % 2 == 0 else "new"
+            target.write(u"host,host{},10.{}.{}.{},{}\n".format(
+                index, (index >> 16) & 255, (index >> 8) & 255, index & 255, comment))
+    results = {}
+    for (name, options) in [("object_import", {}),
+                            ("object_import_diff", {"diff": True}),
+                            ("object_import_chunks", {"chunk_size": max(1, params.import_lines // 4)})]:
+        def run(options=options):
+            args = {"appliance": server.appliance, "path": path, "poll_interval": params.poll_interval,
+                    "cache_dir": os.path.join(folder, "cache")}
+            args.update(options)
+            (result, size) = run_module("sns_object_import", args)
+            return {"lines": params.import_lines, "polls": result['polling']['polls'],
+                    "output_bytes": size}
+        results[name] = measure(params.iterations, run)
+    return results
+
+
+STARTUP = (
+    "import sys, runpy, ansible.module_utils; "
+    "ansible.module_utils.__path__.append(sys.argv.pop(1)); "
+    "runpy.run_path(sys.argv.pop(1), run_name='__main__')"
+)
+
+
+def bench_startup(server, params, folder):
+    '''
+    runs sns_command in a fresh interpreter as a task would, the startup trace of
+    the client factory gives the time spent before the first connection
+    '''
+    args = os.path.join(folder, "startup-args.json")
+    trace = os.path.join(folder, "startup.jsonl")
+    with open(args, 'w') as target:
+        json.dump({"ANSIBLE_MODULE_ARGS": {"appliance": server.appliance, "command": "SYSTEM PROPERTY"}}, target)
+    env = dict(os.environ, SNS_STARTUP_TRACE=trace)
+
+    def run():
+        subprocess.check_call([sys.executable, "-c", STARTUP, os.path.join(ROOT, "module_utils"),
+                               os.path.join(ROOT, "library", "sns_command.py"), args],
+                              env=env, stdout=subprocess.DEVNULL)
+    stats = measure(params.iterations, run)
+    with open(trace) as source:
+        records = [json.loads(line) for line in source]
+    ages = [record['process_age'] for record in records if record['process_age'] is not None]
+    if ages:
+        stats['until_client'] = round(statistics.median(ages), 6)
+    stats['imports'] = round(statistics.median(sum(record['imports'].values()) for record in records), 6)
+    return {"startup": stats}
+
+
+BENCHMARKS = [
+    ("startup", bench_startup),
+    ("connect", bench_connect),
+    ("command", bench_command),
+    ("script", bench_script),
+    ("large_result", bench_large_result),
+    ("getconf", bench_getconf),
+    ("object_import", bench_object_import),
+]
+
+
+def compare(results, baseline, tolerance):
+    '''
+    returns the benchmarks whose median duration exceeds the baseline by more than the tolerance
+    '''
+    regressions = []
+    for (name, stats) in results['benchmarks'].items():
+        reference = baseline.get('benchmarks', {}).get(name)
+        if reference is None or not reference.get('median'):
+            continue
+        ratio = stats['median'] / reference['median']
+        if ratio > 1 + tolerance:
+            regressions.append({"benchmark": name, "median": stats['median'],
+                                "baseline": reference['median'], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SNS modules against a local mock server")
+    parser.add_argument("--output", default="sns-benchmark.json", help="result file")
+    parser.add_argument("--baseline", help="previous result file to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="accepted median increase over the baseline (default 0.25)")
+    parser.add_argument("--only", action="append", choices=[name for (name, _) in BENCHMARKS],
+                        help="benchmark to run, can be repeated")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="latency of each command in seconds")
+    parser.add_argument("--objects", type=int, default=20000, help="objects returned by CONFIG OBJECT LIST")
+    parser.add_argument("--pending-polls", type=int, default=3,
+                        help="PENDING import status replies before OK")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="poll_interval of sns_object_import")
+    parser.add_argument("--script-commands", type=int, default=200, help="objects created by the script benchmark")
+    parser.add_argument("--import-lines", type=int, default=5000, help="lines of the imported CSV file")
+    params = parser.parse_args()
+
+    # the environment CA bundle would replace the mock server certificate
+    for name in ["REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE"]:
+        os.environ.pop(name, None)
+
+    folder = tempfile.mkdtemp(prefix="sns-benchmark-")
+    os.environ['HOME'] = folder
+    results = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": dict(vars(params)),
+        "benchmarks": {},
+    }
+    try:
+        with MockServer(objects=params.objects, pending_polls=params.pending_polls,
+                        latency=params.latency) as server:
+            for (name, bench) in BENCHMARKS:
+                if params.only and name not in params.only:
+                    continue
+                for (key, stats) in bench(server, params, folder).items():
+                    results['benchmarks'][key] = stats
+                    print("{:<26} median {:>10.4f}s  min {:>10.4f}s  max {:>10.4f}s".format(
+                        key, stats['median'], stats['min'], stats['max']))
+            results['server'] = server.state.counters
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    status = 0
+    if params.baseline is not None:
+        with open(params.baseline) as source:
+            results['regressions'] = compare(results, json.load(source), params.tolerance)
+        for regression in results['regressions']:
+            print("REGRESSION {benchmark}: {median}s, baseline {baseline}s (x{ratio})".format(**regression))
+        status = 1 if results['regressions'] else 0
+
+    with open(params.output, 'w') as target:
+        json.dump(results, target, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
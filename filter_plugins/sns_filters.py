@@ -0,0 +1,85 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Jinja filters to parse SNS api command results in the controller,
+same behavior as the sns_getconf module without a module execution.
+
+    {{ sysprop.result | sns_conf('Result', 'Version') }}
+    {{ ntpservers.result | sns_conf('Result') }}
+    {{ sysprop.result | sns_config }}
+'''
+
+from collections import OrderedDict
+import threading
+
+from ansible.errors import AnsibleFilterError
+
+try:
+    from stormshield.sns.configparser import ConfigParser, serialize
+    HAS_SNS = True
+except ImportError:
+    HAS_SNS = False
+
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _parse(result):
+    '''
+    returns the parsed result, the last parsed results are memoized
+    '''
+    if not HAS_SNS:
+        raise AnsibleFilterError("SNS filters require python-SNS-API library")
+    if isinstance(result, dict):
+        # registered sns_command result
+        result = result.get('result', '')
+    with _lock:
+        parser = _cache.pop(result, None)
+        if parser is None:
+            parser = ConfigParser(result)
+            if len(_cache) >= CACHE_SIZE:
+                _cache.popitem(last=False)
+        _cache[result] = parser
+    return parser
+
+
+def sns_conf(result, section, token=None, line=None, default=None):
+    '''
+    returns a section, a line or a token from a command result
+    '''
+    parser = _parse(result)
+    if token is None and line is None:
+        return serialize(parser.get(section=section, default={}))
+    if line is not None:
+        return serialize(parser.get(section=section, line=int(line), default=default))
+    return serialize(parser.get(section=section, token=token, default=default))
+
+
+def sns_config(result):
+    '''
+    returns the whole parsed command result
+    '''
+    return _parse(result).serialize_data()
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return {
+            'sns_conf': sns_conf,
+            'sns_config': sns_config,
+        }
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_audit
+short_description: Audit the configuration drift of many Stormshield Network Security appliances
+description:
+  This module runs a set of read-only commands (ie: CONFIG OBJECT LIST) on a list of appliances in parallel
+  and compares their results with a reference appliance or with a baseline file. Results are hashed per
+  section and per row, only the sections whose hash differs are diffed and returned.
+  The section hashes of each appliance are kept in the local result cache, an appliance whose cached
+  hashes are still valid is not queried again.
+options:
+  commands:
+    description:
+      - Commands to audit, list of command, ordered (default false, set to true when the row order matters
+        ie: filter rules) and ignore (row fields excluded from the comparison).
+  reference:
+    description:
+      - Name of the appliance of the list used as reference (default the first appliance when no baseline is set).
+  baseline:
+    description:
+      - Local JSON file saved by save_baseline and used as reference.
+  save_baseline:
+    description:
+      - Local JSON file receiving the results of the reference appliance.
+  max_rows:
+    description:
+      - Maximum number of missing and extra rows returned for each section (default 100).
+  fail_on_drift:
+    description:
+      - Set to true to fail when an appliance differs from the reference.
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  concurrency:
+    description:
+      - Maximum number of appliances handled at the same time (default 10).
+  host_timeout:
+    description:
+      - Maximum duration in seconds for one appliance, the appliance is reported as failed when exceeded.
+  cache_ttl:
+    description:
+      - Validity in seconds of the cached section hashes, 0 to always query the appliances (default 0).
+        The cache of an appliance is invalidated by the modifying commands of sns_command and sns_fleet_command.
+  cache_dir:
+    description:
+      - Folder of the result cache (default ~/.ansible/sns-cache).
+  appliances:
+    description:
+      - list of appliance connection's parameters (name, host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy).
+        Results are keyed by name, or by host if name is not set.
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Compare the objects and filter rules of the appliances with the first one
+  sns_audit:
+    commands:
+      - command: CONFIG OBJECT LIST type=host
+      - command: CONFIG FILTER EXPLICIT index=9 type=filter
+        ordered: true
+        ignore:
+          - ruleid
+    reference: master
+    save_baseline: /audit/baseline.json
+    cache_ttl: 3600
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+  delegate_to: localhost
+
+- name: Compare the appliances with the saved baseline
+  sns_audit:
+    commands:
+      - command: CONFIG OBJECT LIST type=host
+    baseline: /audit/baseline.json
+    fail_on_drift: true
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+  delegate_to: localhost
+'''
+
+RETURN = '''
+results:
+  description: audit result of each appliance, keyed by appliance name, with the differing sections of each command
+  returned: always
+  type: complex
+  sample: |
+    {'appliance1': {'failed': False, 'drift': False, 'sections': {}, 'cached': True, 'elapsed': 0.0},
+     'appliance2': {'failed': False, 'drift': True, 'cached': False, 'elapsed': 1.2,
+                    'sections': {'CONFIG OBJECT LIST type=host': {'Object': {
+                        'missing': 1, 'extra': 0, 'reordered': False, 'extra_rows': [],
+                        'missing_rows': [{'type': 'host', 'name': 'srv1', 'ip': '10.0.0.1'}]}}}}}
+drifted_hosts:
+  description: names of the appliances which differ from the reference
+  returned: always
+  type: list
+  sample: ['appliance2']
+failed_hosts:
+  description: names of the appliances on which the audit failed
+  returned: always
+  type: list
+  sample: []
+'''
+
+import json
+import os
+import tempfile
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_audit import compare, digest, section_hashes, snapshot
+from ansible.module_utils.sns_cache import ResultCache
+from ansible.module_utils.sns_client import appliances_spec, new_client
+from ansible.module_utils.sns_fleet import Fleet, appliance_name, client_options
+
+CACHE_KEY = "sns_audit"
+
+
+def fetch(client, command):
+    response = client.send_command(command)
+    if response.ret >= 200:
+        raise Exception("{} failed: {}".format(command, response.output))
+    return response.parser.serialize_data()
+
+
+def read_baseline(path):
+    with open(path) as source:
+        return json.load(source)['commands']
+
+
+def write_baseline(path, data):
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as target:
+        json.dump({"saved_at": time.time(), "commands": data}, target, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def audit_appliance(appliance, commands, reference, options, max_rows):
+    '''
+    Compares the results of the commands on one appliance with the reference snapshots.
+        Returns:
+                result (dict): differing sections of each command and section hashes
+    '''
+    client = new_client(appliance, **options)
+    client.connect()
+
+    sections = {}
+    hashes = {}
+    try:
+        for spec in commands:
+            # one result at a time, large tables are not kept once compared
+            current = snapshot(fetch(client, spec['command']), spec['ignore'], spec['ordered'])
+            hashes[spec['command']] = section_hashes(current)
+            diff = compare(reference[spec['command']], current, max_rows)
+            if diff:
+                sections[spec['command']] = diff
+    finally:
+        client.disconnect()
+    return {"failed": False, "drift": bool(sections), "sections": sections}, hashes
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "commands": {
+                "required": True, "type": "list", "elements": "dict",
+                "options": {
+                    "command": {"required": True, "type": "str"},
+                    "ordered": {"required": False, "type": "bool", "default": False},
+                    "ignore": {"required": False, "type": "list", "elements": "str", "default": []},
+                }
+            },
+            "reference": {"required": False, "type": "str", "default": None},
+            "baseline": {"required": False, "type": "path", "default": None},
+            "save_baseline": {"required": False, "type": "path", "default": None},
+            "max_rows": {"required": False, "type": "int", "default": 100},
+            "fail_on_drift": {"required": False, "type": "bool", "default": False},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "concurrency": {"required": False, "type": "int", "default": 10},
+            "host_timeout": {"required": False, "type": "int", "default": None},
+            "cache_ttl": {"required": False, "type": "int", "default": 0},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "appliances": appliances_spec()
+        },
+        supports_check_mode=True
+    )
+
+    commands = module.params['commands']
+    appliances = module.params['appliances']
+    reference = module.params['reference']
+    baseline = module.params['baseline']
+    cache_ttl = module.params['cache_ttl']
+
+    if not commands:
+        module.fail_json(msg="At least one command is required")
+
+    names = [appliance_name(appliance) for appliance in appliances]
+    if len(set(names)) != len(names):
+        module.fail_json(msg="Appliance names must be unique")
+    if len(set(spec['command'] for spec in commands)) != len(commands):
+        module.fail_json(msg="Commands must be unique")
+
+    if baseline is not None and reference is not None:
+        module.fail_json(msg="Got both reference and baseline")
+    if baseline is not None and module.params['save_baseline'] is not None:
+        module.fail_json(msg="save_baseline requires a reference appliance")
+    if baseline is None:
+        if not appliances:
+            module.fail_json(msg="A reference appliance or a baseline is required")
+        if reference is None:
+            reference = names[0]
+        if reference not in names:
+            module.fail_json(msg="Unknown reference appliance {}".format(reference))
+
+    options = client_options(module.params['timeout'], module.params['host_timeout'])
+
+    # reference snapshots of each command, from the baseline file or from the reference appliance
+    try:
+        if baseline is not None:
+            data = read_baseline(baseline)
+            missing = [spec['command'] for spec in commands if spec['command'] not in data]
+            if missing:
+                module.fail_json(msg="Commands missing from the baseline: {}".format(", ".join(missing)))
+        else:
+            client = new_client(appliances[names.index(reference)], **options)
+            client.connect()
+            try:
+                data = dict((spec['command'], fetch(client, spec['command'])) for spec in commands)
+            finally:
+                client.disconnect()
+            if module.params['save_baseline'] is not None and not module.check_mode:
+                write_baseline(module.params['save_baseline'], data)
+    except Exception as exception:
+        module.fail_json(msg="Can't get the reference: {}".format(str(exception)))
+
+    snapshots = dict((spec['command'], snapshot(data[spec['command']], spec['ignore'], spec['ordered']))
+                     for spec in commands)
+    del data
+    reference_hashes = dict((command, section_hashes(sections)) for (command, sections) in snapshots.items())
+    # the cached results are reused with the same commands and the same reference only
+    commands_digest = digest(commands)
+    reference_digest = digest(reference_hashes)
+
+    def task(appliance, deadline):
+        if appliance_name(appliance) == reference:
+            return {"failed": False, "drift": False, "sections": {}, "cached": False, "reference": True}
+        cache = ResultCache(appliance, module.params['cache_dir'])
+        if cache_ttl > 0:
+            entry = cache.get_entry(CACHE_KEY)
+            if entry is not None and entry['commands'] == commands_digest:
+                if entry['hashes'] == reference_hashes:
+                    # unchanged appliance, identical to the new reference
+                    return {"failed": False, "drift": False, "sections": {}, "cached": True}
+                if entry['reference'] == reference_digest:
+                    result = entry['result']
+                    result['cached'] = True
+                    return result
+        (result, hashes) = audit_appliance(appliance, commands, snapshots, options, module.params['max_rows'])
+        if cache_ttl > 0:
+            cache.set_entry(CACHE_KEY, {"commands": commands_digest, "reference": reference_digest,
+                                        "hashes": hashes, "result": result}, cache_ttl)
+        result['cached'] = False
+        return result
+
+    fleet = Fleet(appliances, module.params['concurrency'], module.params['host_timeout'], task)
+    results = dict((names[index], result) for (index, result) in fleet.run().items())
+    failed_hosts = sorted(name for (name, result) in results.items() if result['failed'])
+    drifted_hosts = sorted(name for (name, result) in results.items() if result.get('drift'))
+
+    if failed_hosts:
+        module.fail_json(msg="Errors on {} appliance(s)".format(len(failed_hosts)),
+                         results=results, failed_hosts=failed_hosts, drifted_hosts=drifted_hosts)
+    if drifted_hosts and module.params['fail_on_drift']:
+        module.fail_json(msg="Configuration drift on {} appliance(s)".format(len(drifted_hosts)),
+                         results=results, failed_hosts=failed_hosts, drifted_hosts=drifted_hosts)
+    module.exit_json(changed=False, results=results, failed_hosts=failed_hosts, drifted_hosts=drifted_hosts)
+
+
+if __name__ == '__main__':
+    main()
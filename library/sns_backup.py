@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_backup
+short_description: Backup the configuration of many Stormshield Network Security appliances in a deduplicated store
+description:
+  This module downloads the configuration backup of a list of appliances in parallel.
+  Backups are stored once per content in a content-addressed store, named by their sha256 hash,
+  and the index.jsonl file of the store records the appliance name, the timestamp and the hash of each backup.
+options:
+  dest:
+    description:
+      - Backup store folder.
+  list:
+    description:
+      - Configuration modules to backup, value of the list parameter of CONFIG BACKUP (default all).
+  keep:
+    description:
+      - Number of backups to keep per appliance in the index. Older entries are removed and the backup
+        files which are not referenced anymore are deleted.
+  concurrency:
+    description:
+      - Maximum number of appliances handled at the same time (default 10).
+  host_timeout:
+    description:
+      - Maximum duration in seconds for one appliance, the appliance is reported as failed when exceeded.
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  detach:
+    description:
+      - Set to true to run the task in the background and return its job_id right away. The progress (number of
+        completed and failed appliances) and the result are read with sns_job_status.
+  job_dir:
+    description:
+      - Folder of the job state files (default ~/.ansible/sns-jobs).
+  appliances:
+    description:
+      - list of appliance connection's parameters (name, host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy).
+        Results are keyed by name, or by host if name is not set.
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Backup all the appliances of the inventory
+  sns_backup:
+    dest: /backup/sns
+    keep: 30
+    concurrency: 20
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+  delegate_to: localhost
+'''
+
+RETURN = '''
+results:
+  description: backup of each appliance, keyed by appliance name
+  returned: always
+  type: complex
+  sample: |
+    {'appliance1': {'failed': False, 'sha256': '9f86d0...', 'size': 81920, 'unchanged': True,
+                    'path': '/backup/sns/objects/9f/9f86d0....na', 'elapsed': 2.1}}
+failed_hosts:
+  description: names of the appliances which could not be backed up
+  returned: always
+  type: list
+  sample: []
+pruned:
+  description: number of backup files deleted by the retention
+  returned: always
+  type: int
+  sample: 3
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_client import appliances_spec, new_client
+from ansible.module_utils.sns_fleet import Fleet, appliance_name, client_options
+from ansible.module_utils.sns_job import detach
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def object_path(dest, digest):
+    return os.path.join(dest, "objects", digest[:2], digest + ".na")
+
+
+def hash_file(path):
+    '''
+    returns the sha256 and the size of a file, read in bounded memory
+    '''
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def backup_appliance(appliance, dest, backup_list, options):
+    '''
+    Downloads the backup of one appliance in the store.
+        Returns:
+                result (dict): sha256, size and path of the stored backup
+    '''
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.join(dest, "tmp"), suffix=".na")
+    os.close(fd)
+    try:
+        client = new_client(appliance, **options)
+        client.connect()
+        try:
+            response = client.send_command("CONFIG BACKUP list={} > {}".format(backup_list, tmp))
+        finally:
+            client.disconnect()
+        if response.ret >= 200:
+            return {"failed": True, "msg": "Backup failed", "result": response.output, "ret": response.ret}
+
+        # the download is written by SSLClient, it is hashed from the page cache right after
+        (digest, size) = hash_file(tmp)
+        if size == 0:
+            return {"failed": True, "msg": "Empty backup"}
+        path = object_path(dest, digest)
+        stored = os.path.exists(path)
+        if not stored:
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass # created by another worker
+            os.rename(tmp, path)
+        return {"failed": False, "sha256": digest, "size": size, "path": path, "stored": not stored}
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def read_index(dest):
+    entries = []
+    index = os.path.join(dest, "index.jsonl")
+    if os.path.exists(index):
+        with open(index) as source:
+            for line in source:
+                if line.strip():
+                    entries.append(json.loads(line))
+    return entries
+
+
+def write_index(dest, entries):
+    (fd, tmp) = tempfile.mkstemp(dir=dest)
+    with os.fdopen(fd, 'w') as target:
+        for entry in entries:
+            target.write(json.dumps(entry, sort_keys=True) + "\n")
+    os.rename(tmp, os.path.join(dest, "index.jsonl"))
+
+
+def prune(dest, entries, keep):
+    '''
+    keeps the last backups of each appliance and deletes the unreferenced files.
+        Returns:
+                entries (list): remaining index entries
+                pruned (int): number of deleted backup files
+    '''
+    if keep is not None:
+        count = {}
+        remaining = []
+        for entry in reversed(entries):
+            count[entry['host']] = count.get(entry['host'], 0) + 1
+            if count[entry['host']] <= keep:
+                remaining.append(entry)
+        entries = list(reversed(remaining))
+
+    referenced = set(entry['sha256'] for entry in entries)
+    pruned = 0
+    for (folder, _, files) in os.walk(os.path.join(dest, "objects")):
+        for name in files:
+            if name.endswith(".na") and name[:-3] not in referenced:
+                os.unlink(os.path.join(folder, name))
+                pruned += 1
+    return entries, pruned
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "dest": {"required": True, "type": "path"},
+            "list": {"required": False, "type": "str", "default": "all"},
+            "keep": {"required": False, "type": "int", "default": None},
+            "concurrency": {"required": False, "type": "int", "default": 10},
+            "host_timeout": {"required": False, "type": "int", "default": None},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "detach": {"required": False, "type": "bool", "default": False},
+            "job_dir": {"required": False, "type": "str", "default": None},
+            "appliances": appliances_spec()
+        }
+    )
+
+    dest = module.params['dest']
+    appliances = module.params['appliances']
+
+    if module.params['keep'] is not None and module.params['keep'] < 1:
+        module.fail_json(msg="keep must be at least 1")
+
+    names = [appliance_name(appliance) for appliance in appliances]
+    if len(set(names)) != len(names):
+        module.fail_json(msg="Appliance names must be unique")
+
+    for folder in [dest, os.path.join(dest, "objects"), os.path.join(dest, "tmp")]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder, 0o700)
+
+    options = client_options(module.params['timeout'], module.params['host_timeout'])
+
+    def task(appliance, deadline):
+        return backup_appliance(appliance, dest, module.params['list'], options)
+
+    try:
+        job = detach(module)
+    except Exception as exception:
+        module.fail_json(msg="Can't start the job: {}".format(str(exception)))
+    if job is not None:
+        task = job.track(task, appliances)
+
+    # the store is shared by concurrent runs, a run must not prune the files of another one
+    with open(os.path.join(dest, ".lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        fleet = Fleet(appliances, module.params['concurrency'], module.params['host_timeout'], task)
+        results = dict((names[index], result) for (index, result) in fleet.run().items())
+        failed_hosts = sorted(name for (name, result) in results.items() if result['failed'])
+
+        timestamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        entries = read_index(dest)
+        latest = dict((entry['host'], entry['sha256']) for entry in entries)
+        for name in names:
+            result = results[name]
+            if result['failed']:
+                continue
+            result['unchanged'] = latest.get(name) == result['sha256']
+            entries.append({"host": name, "timestamp": timestamp,
+                            "sha256": result['sha256'], "size": result['size']})
+        entries, pruned = prune(dest, entries, module.params['keep'])
+        write_index(dest, entries)
+
+    changed = any([result.pop('stored', False) for result in results.values()])
+    if failed_hosts:
+        module.fail_json(msg="Backup failed on {} appliance(s)".format(len(failed_hosts)),
+                         changed=changed, results=results, failed_hosts=failed_hosts, pruned=pruned)
+    module.exit_json(changed=changed, results=results, failed_hosts=failed_hosts, pruned=pruned)
+
+
+if __name__ == '__main__':
+    main()
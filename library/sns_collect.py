@@ -0,0 +1,347 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_collect
+short_description: Collect MONITOR samples and logs of a Stormshield Network Security appliance
+description:
+  This module keeps one session open to sample MONITOR commands every interval seconds during
+  duration seconds, and to fetch the new log lines since a checkpoint saved in a local file.
+  Rows are appended to local JSON Lines files as they are received instead of being returned.
+options:
+  monitor:
+    description:
+      - MONITOR commands to sample (ie: MONITOR SYSTEM).
+  monitor_file:
+    description:
+      - Local JSON Lines file receiving the MONITOR rows, with the sample time, the command and the section of each row.
+  logs:
+    description:
+      - Logs to fetch, list of name, command and checkpoint_field. {checkpoint} in the command is replaced by the
+        last saved checkpoint, the command must return the log lines as rows. Only the rows whose checkpoint_field
+        (default time) is greater than or equal to the checkpoint are written, the greatest value becomes the new
+        checkpoint. Rows already written at the checkpoint value are skipped.
+  log_file:
+    description:
+      - Local JSON Lines file receiving the log rows, with the log name and the section of each row.
+  checkpoint_file:
+    description:
+      - Local JSON file storing the checkpoint of each log and the hashes of the rows written at this checkpoint,
+        updated after each fetch.
+  interval:
+    description:
+      - Delay in seconds between two samples (default 10).
+  duration:
+    description:
+      - Collection duration in seconds, a single sample is collected when 0 (default 0).
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  appliance:
+    description:
+      - appliance connection's parameters (host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy)
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Sample the system and interface counters every 10 seconds during 5 minutes
+  sns_collect:
+    appliance:
+      host: myappliance.local
+      password: mypassword
+    monitor:
+      - MONITOR SYSTEM
+      - MONITOR INTERFACE
+    monitor_file: /var/log/sns/monitor.jsonl
+    logs:
+      - name: alarm
+        command: "LOG SEARCH type=alarm since={checkpoint}"
+    log_file: /var/log/sns/logs.jsonl
+    checkpoint_file: /var/log/sns/checkpoints.json
+    interval: 10
+    duration: 300
+  delegate_to: localhost
+'''
+
+RETURN = '''
+samples:
+  description: number of collection cycles
+  returned: always
+  type: int
+  sample: 30
+rows:
+  description: number of rows written, for the monitor commands and for each log
+  returned: always
+  type: dict
+  sample: {'monitor': 1260, 'logs': {'alarm': 12}}
+checkpoints:
+  description: checkpoint of each log after the collection
+  returned: when logs are set
+  type: dict
+  sample: {'alarm': '2018-10-01 12:00:03'}
+reconnects:
+  description: number of reconnections after a lost session
+  returned: always
+  type: int
+  sample: 0
+errors:
+  description: number of commands which returned an error
+  returned: always
+  type: int
+  sample: 0
+'''
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_client import appliance_spec, module_client
+from ansible.module_utils.sns_projection import append_rows, iter_rows
+
+
+def compare(value, checkpoint):
+    '''
+    compares a value with a checkpoint, numerically when possible. Returns -1, 0 or 1,
+    any value is greater than a missing checkpoint.
+    '''
+    if checkpoint is None or checkpoint == "":
+        return 1
+    try:
+        (value, checkpoint) = (float(value), float(checkpoint))
+    except ValueError:
+        (value, checkpoint) = (str(value), str(checkpoint))
+    return (value > checkpoint) - (value < checkpoint)
+
+
+def row_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def read_checkpoints(path):
+    '''
+    returns the checkpoint of each log and the hashes of the rows already written at this checkpoint
+    '''
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path) as source:
+        content = json.load(source)
+    checkpoints = {}
+    seen = {}
+    for (name, entry) in content.items():
+        if isinstance(entry, dict):
+            checkpoints[name] = entry['checkpoint']
+            seen[name] = set(entry.get('seen', []))
+        else:
+            # checkpoint files written without the row hashes
+            checkpoints[name] = entry
+            seen[name] = set()
+    return checkpoints, seen
+
+
+def write_checkpoints(path, checkpoints, seen):
+    content = dict((name, {"checkpoint": value, "seen": sorted(seen.get(name, []))})
+                   for (name, value) in checkpoints.items())
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as target:
+        json.dump(content, target, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def write_new_rows(target, data, field, checkpoint, seen, name):
+    '''
+    appends the rows newer than the checkpoint, and the rows at the checkpoint which were not written yet.
+        Returns:
+                count (int): number of written rows
+                latest: new checkpoint
+                seen (set): hashes of the rows written at the new checkpoint
+    '''
+    count = 0
+    latest = checkpoint
+    latest_seen = set(seen)
+    for record in iter_rows(data, log=name):
+        value = record.get(field)
+        if value is None:
+            continue
+        position = compare(value, checkpoint)
+        if position < 0:
+            continue
+        digest = row_hash(record)
+        # log lines sharing the checkpoint value may arrive after the previous fetch
+        if position == 0 and digest in seen:
+            continue
+        target.write(json.dumps(record) + "\n")
+        count += 1
+        order = compare(value, latest)
+        if order > 0:
+            latest = value
+            latest_seen = set()
+        if order >= 0:
+            latest_seen.add(digest)
+    target.flush()
+    return count, latest, latest_seen
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "monitor": {"required": False, "type": "list", "elements": "str", "default": []},
+            "monitor_file": {"required": False, "type": "path", "default": None},
+            "logs": {
+                "required": False, "type": "list", "elements": "dict", "default": [],
+                "options": {
+                    "name": {"required": True, "type": "str"},
+                    "command": {"required": True, "type": "str"},
+                    "checkpoint_field": {"required": False, "type": "str", "default": "time"},
+                }
+            },
+            "log_file": {"required": False, "type": "path", "default": None},
+            "checkpoint_file": {"required": False, "type": "path", "default": None},
+            "interval": {"required": False, "type": "float", "default": 10},
+            "duration": {"required": False, "type": "float", "default": 0},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "appliance": appliance_spec()
+        }
+    )
+
+    monitors = module.params['monitor']
+    logs = module.params['logs']
+
+    if not monitors and not logs:
+        module.fail_json(msg="monitor commands or logs are required")
+    if monitors and module.params['monitor_file'] is None:
+        module.fail_json(msg="monitor_file is required with monitor commands")
+    if logs and (module.params['log_file'] is None or module.params['checkpoint_file'] is None):
+        module.fail_json(msg="log_file and checkpoint_file are required with logs")
+    if module.params['interval'] <= 0:
+        module.fail_json(msg="interval must be positive")
+
+    checkpoints = {}
+    seen = {}
+    if logs:
+        try:
+            (checkpoints, seen) = read_checkpoints(module.params['checkpoint_file'])
+        except Exception as exception:
+            module.fail_json(msg="Can't read checkpoint file: {}".format(str(exception)))
+
+    state = {"client": None, "samples": 0, "reconnects": 0, "errors": 0}
+    rows = {"monitor": 0, "logs": dict((log['name'], 0) for log in logs)}
+
+    def summary():
+        result = {"samples": state['samples'], "rows": rows, "reconnects": state['reconnects'],
+                  "errors": state['errors']}
+        if logs:
+            result['checkpoints'] = checkpoints
+        return result
+
+    def connect():
+        if state['client'] is not None:
+            try:
+                state['client'].disconnect()
+            except Exception:
+                pass
+        state['client'] = None
+        client = module_client(module)
+        client.connect()
+        state['client'] = client
+
+    def send(command):
+        '''
+        sends a command, the session is reopened once when it was lost
+        '''
+        try:
+            response = state['client'].send_command(command)
+        except Exception:
+            connect()
+            state['reconnects'] += 1
+            response = state['client'].send_command(command)
+        if response.ret >= 200:
+            state['errors'] += 1
+            return None
+        return response
+
+    files = []
+    try:
+        connect()
+        monitor_file = None
+        log_file = None
+        if monitors:
+            monitor_file = io.open(module.params['monitor_file'], 'a', encoding='utf-8')
+            files.append(monitor_file)
+        if logs:
+            log_file = io.open(module.params['log_file'], 'a', encoding='utf-8')
+            files.append(log_file)
+
+        start = time.time()
+        end = start + module.params['duration']
+        cycle = start
+        while True:
+            sample_time = time.time()
+            for command in monitors:
+                response = send(command)
+                if response is not None:
+                    rows['monitor'] += append_rows(monitor_file, response.parser.serialize_data(),
+                                                   time=sample_time, command=command)
+            for log in logs:
+                checkpoint = checkpoints.get(log['name'])
+                response = send(log['command'].replace("{checkpoint}", str(checkpoint or "")))
+                if response is None:
+                    continue
+                (count, latest, latest_seen) = write_new_rows(
+                    log_file, response.parser.serialize_data(), log['checkpoint_field'], checkpoint,
+                    seen.get(log['name'], set()), log['name'])
+                rows['logs'][log['name']] += count
+                if count:
+                    checkpoints[log['name']] = latest
+                    seen[log['name']] = latest_seen
+                    write_checkpoints(module.params['checkpoint_file'], checkpoints, seen)
+            state['samples'] += 1
+
+            # fixed rate sampling, the command durations do not shift the next samples
+            cycle += module.params['interval']
+            if cycle >= end:
+                break
+            delay = cycle - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    except Exception as exception:
+        module.fail_json(msg=str(exception), **summary())
+    finally:
+        for target in files:
+            target.close()
+        if state['client'] is not None:
+            try:
+                state['client'].disconnect()
+            except Exception:
+                # the collected rows and the failure are reported anyway
+                pass
+
+    module.exit_json(changed=rows['monitor'] > 0 or any(rows['logs'].values()), **summary())
+
+
+if __name__ == '__main__':
+    main()
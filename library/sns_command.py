@@ -35,9 +35,71 @@ options:
   force_modify:
     description:
       - Set to true to disconnect other administrator already connected with modify privilege.
+  keep_results:
+    description:
+      - Script commands returned in the results list, all, failed (default) or none.
+  coalesce_activations:
+    description:
+      - Set to true to defer the CONFIG <subsystem> ACTIVATE commands of the script and activate each subsystem once,
+        before the next command outside CONFIG or activation with parameters (ie CONFIG SLOT ACTIVATE), or at the end of the script.
+  keep_output:
+    description:
+      - Set to false to not return the raw script output, which can be large for huge scripts.
   timeout:
     description:
       - Set the connection and read timeout.
+  broker:
+    description:
+      - Send the commands through the local session broker which keeps the appliance session open between tasks.
+  broker_socket:
+    description:
+      - Unix socket of the session broker (default ~/.ansible/sns-broker.sock).
+  broker_idle_timeout:
+    description:
+      - Close broker sessions and stop the broker after this number of seconds without activity (default 300).
+  sections:
+    description:
+      - Sections of the command result to return in data.
+  fields:
+    description:
+      - Fields to keep in each row (or token of a section) of the command result.
+  where:
+    description:
+      - Only keep the rows whose fields are equal to all the values of this dict.
+  data_file:
+    description:
+      - Write the (projected) parsed command result to this local file as JSON Lines, one row per line with its section name,
+        and return the file path and the number of rows per section instead of data and result.
+  keep_result:
+    description:
+      - Set to false to not return the raw command output in result.
+  cache:
+    description:
+      - Set to true to cache the result of read-only commands (SYSTEM PROPERTY, HA INFO, CONFIG ... LIST) in the controller.
+        Any other command sent to the appliance invalidates its cached results.
+  cache_ttl:
+    description:
+      - Time to live in seconds of the cached result, overrides the default time to live of the command.
+  cache_dir:
+    description:
+      - Cache folder (default ~/.ansible/sns-cache).
+  cache_max_size:
+    description:
+      - Maximum size in bytes of the cache, the oldest results are evicted first (default 64MB).
+  timings:
+    description:
+      - Set to true to return the duration of the connection, of the authentication, of the modify privilege
+        and of each command with the transferred bytes in the timings property.
+  timings_file:
+    description:
+      - Append the timings of the task as a JSON line to this local file.
+  detach:
+    description:
+      - Set to true to run the task in the background and return its job_id right away. The progress (current command,
+        number of sent commands, uploaded and downloaded bytes) and the result are read with sns_job_status.
+  job_dir:
+    description:
+      - Folder of the job state files (default ~/.ansible/sns-jobs).
   appliance:
     description:
       - appliance connection's parameters (host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy)
@@ -76,7 +138,7 @@ ret:
   sample: 100
 output:
   description: script execution output
-  returned: changed
+  returned: when keep_output is set
   type: string
   sample: |
     > CONFIG NTP SERVER LIST
@@ -104,6 +166,19 @@ output:
     USER       : User related functions
     VERSION    : Display server version
     100 code=00a00100 msg="Ok"
+activations:
+  description: number of deferred and sent activation commands, and the pending activation commands
+               not sent because the script stopped on an error
+  returned: when coalesce_activations is set
+  type: dict
+  sample: {'deferred': 5, 'sent': 3, 'not_sent': []}
+results:
+  description: structured result of each script command, with its return code, code, message and parsed data
+  returned: when keep_results is all or failed
+  type: list
+  sample: |
+    [{'command': 'CONFIG NTP SERVER LIST', 'ret': 100, 'code': '00a00100', 'msg': 'Ok',
+      'data': {'Result': [{'name': 'fr.pool.ntp.org', 'keynum': 'none', 'type': 'host'}]}}]
 result:
   description: last command output
   returned: changed
@@ -114,6 +189,29 @@ result:
     name=ntp1.stormshieldcs.eu keynum=none type=host
     name=ntp2.stormshieldcs.eu keynum=none type=host
     100 code=00a00100 msg="Ok"
+data_file:
+  description: path of the JSON Lines file with the parsed command result
+  returned: when data_file is set
+  type: str
+  sample: /tmp/objects.jsonl
+rows:
+  description: number of rows written per section in data_file
+  returned: when data_file is set
+  type: dict
+  sample: {'Object': 12034}
+cache:
+  description: cache status of the command result, hit, miss or bypass for commands which are not cacheable
+  returned: when cache is set
+  type: str
+  sample: hit
+timings:
+  description: durations in seconds of the connection (TCP and TLS handshakes), authentication, modify privilege, commands and task
+  returned: when timings is set
+  type: complex
+  sample: |
+    {'connect': 0.052, 'auth': 0.138, 'modify': 0.011, 'total': 0.245,
+     'commands': [{'command': 'SYSTEM PROPERTY', 'ret': 100, 'duration': 0.031, 'send': 0.029,
+                   'receive': 0.002, 'bytes_sent': 15, 'bytes_received': 412}]}
 data:
   description: last parsed command result
   type: complex
@@ -124,11 +222,16 @@ data:
     ]}
 '''
 
-import re
-
-from stormshield.sns.sslclient import SSLClient
+import time
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_broker import DEFAULT_IDLE_TIMEOUT
+from ansible.module_utils.sns_client import appliance_spec, config_parser, module_client
+from ansible.module_utils.sns_cache import ResultCache, DEFAULT_MAX_SIZE, is_modifying, readonly_ttl
+from ansible.module_utils.sns_job import detach
+from ansible.module_utils.sns_projection import project, write_rows
+from ansible.module_utils.sns_script import KEEP_RESULTS, is_command, run_script
+from ansible.module_utils.sns_timings import TimedClient, write_trace
 
 def main():
     module = AnsibleModule(
@@ -137,27 +240,30 @@ def main():
             "script": {"required": False, "type": "str"},
             "expect_disconnect": {"required": False, "type":"bool", "default":False},
             "force_modify": {"required": False, "type":"bool", "default":False},
+            "keep_results": {"required": False, "type": "str", "default": "failed", "choices": KEEP_RESULTS},
+            "keep_output": {"required": False, "type": "bool", "default": True},
+            "coalesce_activations": {"required": False, "type": "bool", "default": False},
             "timeout": {"required": False, "type": "int", "default": None},
-            "appliance": {
-                "required": True, "type": "dict",
-                "options": {
-                    "host": {"required": True, "type": "str"},
-                    "ip": {"required": False, "type": "str"},
-                    "port": {"required": False, "type": "int", "default": 443},
-                    "user": {"required": False, "type": "str", "default": "admin"},
-                    "password": {"required": False, "type": "str"},
-                    "sslverifypeer": {"required": False, "type": "bool", "default": True},
-                    "sslverifyhost": {"required": False, "type": "bool", "default": True},
-                    "cabundle": {"required": False, "type": "str"},
-                    "usercert": {"required": False, "type": "str"},
-                    "proxy":  {"required": False, "type": "str"},
-                }
-            }
+            "broker": {"required": False, "type": "bool", "default": False},
+            "broker_socket": {"required": False, "type": "str", "default": None},
+            "broker_idle_timeout": {"required": False, "type": "int", "default": DEFAULT_IDLE_TIMEOUT},
+            "sections": {"required": False, "type": "list", "elements": "str", "default": None},
+            "fields": {"required": False, "type": "list", "elements": "str", "default": None},
+            "where": {"required": False, "type": "dict", "default": None},
+            "data_file": {"required": False, "type": "str", "default": None},
+            "keep_result": {"required": False, "type": "bool", "default": True},
+            "cache": {"required": False, "type": "bool", "default": False},
+            "cache_ttl": {"required": False, "type": "int", "default": None},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "cache_max_size": {"required": False, "type": "int", "default": DEFAULT_MAX_SIZE},
+            "timings": {"required": False, "type": "bool", "default": False},
+            "timings_file": {"required": False, "type": "str", "default": None},
+            "detach": {"required": False, "type": "bool", "default": False},
+            "job_dir": {"required": False, "type": "str", "default": None},
+            "appliance": appliance_spec()
         }
     )
 
-    EMPTY_RE = re.compile(r'^\s*$')
-
     command = module.params['command']
     script = module.params['script']
     expect_disconnect = module.params['expect_disconnect']
@@ -169,42 +275,97 @@ def main():
     if command is not None and script is not None:
         module.fail_json(msg="Got both command and script")
 
-    options = {}
-    if module.params['timeout'] is not None:
-      options["timeout"] = module.params['timeout']
+    projection = module.params['sections'] or module.params['fields'] or module.params['where']
+
+    def command_result(output, parser):
+        '''
+        returns the raw result and the projected data of a single command
+        '''
+        result = {}
+        if module.params['keep_result'] and module.params['data_file'] is None:
+            result['result'] = output
+        if projection:
+            (_, serialize) = config_parser()
+            data = serialize(project(parser.data, module.params['sections'],
+                                     module.params['fields'], module.params['where']))
+        else:
+            data = parser.serialize_data()
+        if module.params['data_file'] is not None:
+            result['data_file'] = module.params['data_file']
+            result['rows'] = write_rows(module.params['data_file'], data)
+        else:
+            result['data'] = data
+        return result
+
+    cache = ResultCache(module.params['appliance'], module.params['cache_dir'],
+                        module.params['cache_max_size'])
+    cache_status = {}
+    cache_ttl = None
+    commands = [command] if command is not None else script.splitlines()
+    if any(is_modifying(line) for line in commands if is_command(line)):
+        cache.invalidate()
+    elif command is not None and module.params['cache']:
+        cache_ttl = readonly_ttl(command)
+        if cache_ttl is not None and module.params['cache_ttl'] is not None:
+            cache_ttl = module.params['cache_ttl']
+        cached = cache.get(command) if cache_ttl else None
+        if cached is not None:
+            (ConfigParser, _) = config_parser()
+            module.exit_json(changed=True, ret=cached['ret'], cache="hit",
+                             **command_result(cached['output'], ConfigParser(cached['output'])))
+        cache_status['cache'] = "miss" if cache_ttl else "bypass"
 
     try:
-        client = SSLClient(
-            host=module.params['appliance']['host'],
-            ip=module.params['appliance']['ip'],
-            port=module.params['appliance']['port'],
-            user=module.params['appliance']['user'],
-            password=module.params['appliance']['password'],
-            sslverifypeer=module.params['appliance']['sslverifypeer'],
-            sslverifyhost=module.params['appliance']['sslverifyhost'],
-            cabundle=module.params['appliance']['cabundle'],
-            usercert=module.params['appliance']['usercert'],
-            proxy=module.params['appliance']['proxy'],
-            autoconnect=False,
-            **options)
+        job = detach(module)
+    except Exception as exception:
+        module.fail_json(msg="Can't start the job: {}".format(str(exception)))
+
+    try:
+        client = module_client(module)
     except Exception as exception:
         module.fail_json(msg=str(exception))
 
+    if job is not None:
+        # MODIFY FORCE ON is counted in the sent commands
+        job.update(commands=0, total=len([line for line in commands if is_command(line)]) + int(force_modify))
+        client = job.client(client)
+
+    timed = module.params['timings'] or module.params['timings_file'] is not None
+    if timed:
+        client = TimedClient(client)
+
+    def finish(method, **result):
+        if timed:
+            timings = client.result()
+            if module.params['timings']:
+                result['timings'] = timings
+            if module.params['timings_file'] is not None:
+                try:
+                    write_trace(module.params['timings_file'], {
+                        "time": time.time(),
+                        "host": module.params['appliance']['host'],
+                        "user": module.params['appliance']['user'],
+                        "failed": method == module.fail_json,
+                        "timings": timings})
+                except Exception as exception:
+                    module.warn("Can't write timings trace: {}".format(str(exception)))
+        method(**result)
+
     try:
         client.connect()
     except Exception as exception:
-        module.fail_json(msg=str(exception))
+        finish(module.fail_json, msg=str(exception))
 
     if force_modify:
         try:
             response = client.send_command("MODIFY FORCE ON")
         except Exception as exception:
             client.disconnect()
-            module.fail_json(msg="Can't take Modify privilege: {}".format(str(exception)))
+            finish(module.fail_json, msg="Can't take Modify privilege: {}".format(str(exception)))
         if response.ret >= 200:
             client.disconnect()
-            module.fail_json(msg="Can't take Modify privilege", result=response.output,
-                             data=response.parser.serialize_data(), ret=response.ret)
+            finish(module.fail_json, msg="Can't take Modify privilege", result=response.output,
+                   data=response.parser.serialize_data(), ret=response.ret)
 
     if command is not None:
         # execute single command
@@ -212,40 +373,30 @@ def main():
             response = client.send_command(command)
         except Exception as exception:
             client.disconnect()
-            module.fail_json(msg=str(exception))
+            finish(module.fail_json, msg=str(exception))
         client.disconnect()
-        module.exit_json(changed=True, result=response.output,
-                         data=response.parser.serialize_data(), ret=response.ret)
+        if cache_ttl and response.ret < 200:
+            cache.set(command, response, cache_ttl)
+        try:
+            result = command_result(response.output, response.parser)
+        except Exception as exception:
+            finish(module.fail_json, msg="Can't write data file: {}".format(str(exception)),
+                   ret=response.ret)
+        result.update(cache_status)
+        finish(module.exit_json, changed=True, ret=response.ret, **result)
     else:
         # execute script
-        output = ""
-        success = True
-        need_reboot = False
-        for command in script.splitlines():
-            command = command.strip('\r\n')
-            output += command + "\n"
-            if command.startswith('#'):
-                continue
-            if EMPTY_RE.match(command):
-                continue
-            try:
-                response = client.send_command(command)
-                output += response.output + "\n"
-                if response.ret >= 200:
-                    success = False
-                elif response.ret == client.SRV_RET_MUSTREBOOT:
-                    need_reboot = True
-            except Exception as exception:
-                if expect_disconnect and str(exception) == "Server disconnected":
-                    break
-                else:
-                    client.disconnect()
-                    module.fail_json(msg=str(exception), output=output, success=False, need_reboot = need_reboot)
+        result = run_script(client, script, expect_disconnect,
+                            module.params['keep_results'], module.params['keep_output'],
+                            coalesce=module.params['coalesce_activations'])
         client.disconnect()
-        if success:
-            module.exit_json(changed=True, output=output, success=True, need_reboot = need_reboot)
+        error = result.pop('error')
+        if error is not None:
+            finish(module.fail_json, msg=error, **result)
+        if result['success']:
+            finish(module.exit_json, changed=True, **result)
         else:
-            module.fail_json(msg="Errors during the script execution", output=output, success=False, need_reboot = need_reboot)
+            finish(module.fail_json, msg="Errors during the script execution", **result)
 
 
 if __name__ == '__main__':
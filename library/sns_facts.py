@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_facts
+short_description: Gather facts of a Stormshield Network Security appliance
+description:
+  This module gathers the system properties, HA state, NTP servers, DNS servers and webadmin ACL
+  of an appliance over a single session and returns them in the sns_facts variable.
+  With max_age, facts gathered less than max_age seconds ago (ie: from the Ansible fact cache)
+  are returned without connecting to the appliance.
+options:
+  gather_subset:
+    description:
+      - Fact subsets to gather, all, system, ha, ntp, dns or webadmin. A subset prefixed with ! is excluded.
+  max_age:
+    description:
+      - Maximum age in seconds of the cached facts to return instead of gathering them again.
+  cached_facts:
+    description:
+      - Previously gathered facts, set from the sns_facts variable of the host when max_age is set.
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  broker:
+    description:
+      - Use the local session broker, see sns_command.
+  broker_socket:
+    description:
+      - Path of the broker Unix socket.
+  broker_idle_timeout:
+    description:
+      - Idle timeout in seconds of the broker sessions.
+  appliance:
+    description:
+      - appliance connection's parameters (host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy)
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Gather the NTP and DNS configuration
+  sns_facts:
+    appliance:
+      host: myappliance.local
+      password: mypassword
+    gather_subset:
+      - ntp
+      - dns
+    max_age: 600
+  delegate_to: localhost
+
+- debug:
+    msg: "{{ sns_facts.ntp | map(attribute='name') | list }}"
+'''
+
+RETURN = '''
+ansible_facts:
+  description: gathered facts, in the sns_facts variable
+  returned: always
+  type: complex
+  sample: |
+    {'sns_facts': {'system': {'Version': '3.7.1', 'Model': 'V50-A', 'SerialNumber': 'V50XXA0000000'},
+                   'ha': {'enabled': False},
+                   'ntp': [{'name': 'fr.pool.ntp.org', 'keynum': 'none', 'type': 'host'}],
+                   'dns': {'dns1': 'dns1', 'dns2': 'dns2'},
+                   'webadmin': ['any'],
+                   'subsets': ['system', 'ha', 'ntp', 'dns', 'webadmin'],
+                   'gathered_at': 1538060400.0}}
+cached:
+  description: True when the facts were not gathered again
+  returned: always
+  type: bool
+  sample: False
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_broker import DEFAULT_IDLE_TIMEOUT
+from ansible.module_utils.sns_client import appliance_spec, module_client
+from ansible.module_utils.sns_facts import gather, is_fresh, resolve_subsets
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "gather_subset": {"required": False, "type": "list", "elements": "str", "default": ["all"]},
+            "max_age": {"required": False, "type": "int", "default": None},
+            "cached_facts": {"required": False, "type": "dict", "default": None},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "broker": {"required": False, "type": "bool", "default": False},
+            "broker_socket": {"required": False, "type": "str", "default": None},
+            "broker_idle_timeout": {"required": False, "type": "int", "default": DEFAULT_IDLE_TIMEOUT},
+            "appliance": appliance_spec()
+        },
+        supports_check_mode=True
+    )
+
+    try:
+        subsets = resolve_subsets(module.params['gather_subset'])
+    except ValueError as exception:
+        module.fail_json(msg=str(exception))
+
+    cached = module.params['cached_facts']
+    if is_fresh(cached, subsets, module.params['max_age']):
+        module.exit_json(changed=False, cached=True, ansible_facts={"sns_facts": cached})
+
+    try:
+        client = module_client(module)
+        client.connect()
+    except Exception as exception:
+        module.fail_json(msg=str(exception))
+
+    try:
+        facts = gather(client, subsets)
+    except Exception as exception:
+        client.disconnect()
+        module.fail_json(msg=str(exception))
+    client.disconnect()
+
+    module.exit_json(changed=False, cached=False, ansible_facts={"sns_facts": facts})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_firmware_update
+short_description: Rolling firmware update of Stormshield Network Security appliances and clusters
+description:
+  This module updates the firmware of a list of appliances or HA clusters.
+  The firmware is uploaded once per appliance or cluster, appliances are updated in a rolling window
+  of concurrency appliances and no new update is started once the failure budget is exceeded.
+  The end of the reboot is detected by probing the appliance every probe_interval seconds.
+  HA clusters are detected with HA INFO and updated passive first, then active.
+options:
+  firmware:
+    description:
+      - Local firmware update file (.maj). Can be overridden with the firmware key of an appliance.
+  version:
+    description:
+      - Target firmware version. Appliances already running this version are skipped and the
+        update is complete when the appliance reports this version.
+  concurrency:
+    description:
+      - Maximum number of appliances or clusters updated at the same time (default 1).
+  max_failures:
+    description:
+      - Failure budget, no new update is started when more appliances have failed (default 0).
+  reboot_timeout:
+    description:
+      - Maximum duration in seconds of a reboot (default 1200).
+  probe_interval:
+    description:
+      - Delay in seconds between two readiness probes during a reboot (default 5).
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  detach:
+    description:
+      - Set to true to run the task in the background and return its job_id right away. The progress (number of
+        completed and failed appliances) and the result are read with sns_job_status.
+  job_dir:
+    description:
+      - Folder of the job state files (default ~/.ansible/sns-jobs).
+  cache_dir:
+    description:
+      - Folder of the sns_command result cache, invalidated for the updated appliances (default ~/.ansible/sns-cache).
+  appliances:
+    description:
+      - list of appliance connection's parameters (name, host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy, firmware).
+        For a cluster, the connection parameters of the active appliance. Results are keyed by name, or by host if name is not set.
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Update the appliances two by two
+  sns_firmware_update:
+    firmware: "{{ download_folder }}/fwupd-3.7.2-SNS-amd64-M.maj"
+    version: 3.7.2
+    concurrency: 2
+    max_failures: 1
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+  delegate_to: localhost
+'''
+
+RETURN = '''
+results:
+  description: update result of each appliance or cluster, keyed by appliance name
+  returned: always
+  type: complex
+  sample: |
+    {'appliance1': {'failed': False, 'changed': True, 'cluster': False, 'previous_version': '3.7.1',
+                    'version': '3.7.2', 'upload': 35.2, 'reboot': [182.4], 'elapsed': 221.0}}
+failed_hosts:
+  description: names of the appliances or clusters whose update failed or was not started
+  returned: always
+  type: list
+  sample: []
+'''
+
+import os
+import socket
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_client import appliances_spec, new_client
+from ansible.module_utils.sns_cache import ResultCache
+from ansible.module_utils.sns_fleet import Fleet, appliance_name
+from ansible.module_utils.sns_job import detach
+
+
+def connect(appliance, options):
+    client = new_client(appliance, **options)
+    client.connect()
+    return client
+
+
+def port_open(appliance, timeout):
+    '''
+    cheap TCP probe used before a full connection during reboots
+    '''
+    if appliance['proxy'] is not None:
+        return True
+    try:
+        socket.create_connection((appliance['ip'] or appliance['host'], appliance['port']), timeout).close()
+        return True
+    except (socket.error, socket.timeout):
+        return False
+
+
+def wait_ready(appliance, options, check, reboot_timeout, probe_interval):
+    '''
+    Probes the appliance until check(client, went_down) returns True.
+        Returns:
+                duration (float): reboot duration in seconds
+    '''
+    start = time.time()
+    deadline = start + reboot_timeout
+    went_down = False
+    while time.time() < deadline:
+        if port_open(appliance, probe_interval):
+            try:
+                client = connect(appliance, options)
+                try:
+                    if check(client, went_down):
+                        return round(time.time() - start, 3)
+                finally:
+                    client.disconnect()
+            except Exception:
+                went_down = True
+        else:
+            went_down = True
+        time.sleep(probe_interval)
+    raise Exception("Appliance not ready after {} seconds".format(reboot_timeout))
+
+
+def send(client, command, expect_disconnect=False):
+    try:
+        response = client.send_command(command)
+    except Exception as exception:
+        if expect_disconnect and str(exception) == "Server disconnected":
+            return None
+        raise
+    if response.ret >= 200:
+        raise Exception("{} failed: {}".format(command, response.output))
+    return response
+
+
+def version_check(version):
+    '''
+    returns a readiness check of a single appliance after its reboot
+    '''
+    def check(client, went_down):
+        response = client.send_command("SYSTEM PROPERTY")
+        if response.ret >= 200:
+            return False
+        if version is not None:
+            return response.data['Result'].get('Version') == version
+        return went_down
+    return check
+
+
+def ha_check(serial):
+    '''
+    returns a readiness check of a cluster member after its reboot, the member
+    must have been seen unreachable before it is reported ready again
+    '''
+    state = {"down": False}
+
+    def check(client, went_down):
+        response = client.send_command("HA INFO")
+        if response.ret >= 200:
+            return False
+        if serial not in response.data or response.data[serial][0].get('Reply') != '1':
+            state['down'] = True
+            return False
+        return went_down or state['down']
+    return check
+
+
+def update_appliance(appliance, firmware, version, options, reboot_timeout, probe_interval, cache_dir=None):
+    '''
+    Updates one appliance or cluster.
+        Returns:
+                result (dict): versions, upload and reboot durations
+    '''
+    firmware = appliance['firmware'] or firmware
+    if firmware is None or not os.path.exists(firmware):
+        raise Exception("Firmware file {} does not exist".format(firmware))
+
+    result = {"failed": False, "changed": False, "reboot": []}
+    client = connect(appliance, options)
+    try:
+        properties = send(client, "SYSTEM PROPERTY").data['Result']
+        result['previous_version'] = properties.get('Version')
+        if version is not None and properties.get('Version') == version:
+            result['version'] = version
+            return result
+        result['cluster'] = client.send_command("HA INFO").ret == 100
+
+        start = time.time()
+        if result['cluster']:
+            serial_active = properties.get('SerialNumber')
+            members = send(client, "HA CLUSTER LIST").data.get('HA', [])
+            passive = [serial for serial in members if serial != serial_active]
+            send(client, "SYSTEM UPDATE UPLOAD fwserial=all < {}".format(firmware))
+            result['upload'] = round(time.time() - start, 3)
+            send(client, "SYSTEM UPDATE ACTIVATE fwserial=passive")
+        else:
+            send(client, "SYSTEM UPDATE UPLOAD < {}".format(firmware))
+            result['upload'] = round(time.time() - start, 3)
+            send(client, "SYSTEM UPDATE ACTIVATE", expect_disconnect=True)
+    finally:
+        client.disconnect()
+    result['changed'] = True
+    # cached results of the appliance are outdated by the update
+    ResultCache(appliance, cache_dir).invalidate()
+
+    if result['cluster']:
+        for serial in passive:
+            result['reboot'].append(wait_ready(appliance, options, ha_check(serial),
+                                               reboot_timeout, probe_interval))
+        client = connect(appliance, options)
+        try:
+            send(client, "SYSTEM UPDATE ACTIVATE fwserial=active", expect_disconnect=True)
+        finally:
+            client.disconnect()
+        result['reboot'].append(wait_ready(appliance, options, ha_check(serial_active),
+                                           reboot_timeout, probe_interval))
+    else:
+        result['reboot'].append(wait_ready(appliance, options, version_check(version),
+                                           reboot_timeout, probe_interval))
+
+    client = connect(appliance, options)
+    try:
+        result['version'] = send(client, "SYSTEM PROPERTY").data['Result'].get('Version')
+    finally:
+        client.disconnect()
+    if version is not None and result['version'] != version:
+        result['failed'] = True
+        result['msg'] = "Appliance runs version {} after the update".format(result['version'])
+    return result
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "firmware": {"required": False, "type": "path", "default": None},
+            "version": {"required": False, "type": "str", "default": None},
+            "concurrency": {"required": False, "type": "int", "default": 1},
+            "max_failures": {"required": False, "type": "int", "default": 0},
+            "reboot_timeout": {"required": False, "type": "int", "default": 1200},
+            "probe_interval": {"required": False, "type": "int", "default": 5},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "detach": {"required": False, "type": "bool", "default": False},
+            "job_dir": {"required": False, "type": "str", "default": None},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "appliances": appliances_spec(firmware={"required": False, "type": "path"})
+        }
+    )
+
+    appliances = module.params['appliances']
+
+    names = [appliance_name(appliance) for appliance in appliances]
+    if len(set(names)) != len(names):
+        module.fail_json(msg="Appliance names must be unique")
+
+    options = {}
+    if module.params['timeout'] is not None:
+        options["timeout"] = module.params['timeout']
+
+    budget = {"failures": 0}
+    lock = threading.Lock()
+
+    def task(appliance, deadline):
+        with lock:
+            if budget['failures'] > module.params['max_failures']:
+                return {"failed": True, "skipped": True, "msg": "Failure budget exceeded, update not started"}
+        try:
+            result = update_appliance(appliance, module.params['firmware'], module.params['version'], options,
+                                      module.params['reboot_timeout'], module.params['probe_interval'],
+                                      module.params['cache_dir'])
+        except Exception as exception:
+            result = {"failed": True, "msg": str(exception)}
+        if result['failed']:
+            with lock:
+                budget['failures'] += 1
+        return result
+
+    try:
+        job = detach(module)
+    except Exception as exception:
+        module.fail_json(msg="Can't start the job: {}".format(str(exception)))
+    if job is not None:
+        task = job.track(task, appliances)
+
+    fleet = Fleet(appliances, module.params['concurrency'], None, task)
+    results = dict((names[index], result) for (index, result) in fleet.run().items())
+    failed_hosts = sorted(name for (name, result) in results.items() if result['failed'])
+    changed = any(result.get('changed') for result in results.values())
+
+    if failed_hosts:
+        module.fail_json(msg="Update failed on {} appliance(s)".format(len(failed_hosts)),
+                         changed=changed, results=results, failed_hosts=failed_hosts)
+    module.exit_json(changed=changed, results=results, failed_hosts=failed_hosts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_fleet_command
+short_description: Execute a command or a script on many Stormshield Network Security appliances in parallel
+description:
+  This module executes the same configuration command or script on a list of appliances.
+  Appliances are handled concurrently by a bounded pool of workers.
+  Configuration API reference: https://documentation.stormshield.eu/SNS/v3/en/Content/CLI_Serverd_Commands_reference_Guide_v3/Introduction.htm
+options:
+  command:
+    description:
+      - Configuration command to execute. The {name} string is replaced by the appliance name.
+  script:
+    description:
+      - Configuration script to execute. The {name} string is replaced by the appliance name.
+  expect_disconnect:
+    description
+      - Set to True if the script makes the remote server to disconnect (ie: install firmware update)
+  force_modify:
+    description:
+      - Set to true to disconnect other administrator already connected with modify privilege.
+  keep_results:
+    description:
+      - Script commands returned in the results list of each appliance, all, failed (default) or none.
+  coalesce_activations:
+    description:
+      - Set to true to defer the CONFIG <subsystem> ACTIVATE commands of the script and activate each subsystem once,
+        before the next command outside CONFIG or activation with parameters (ie CONFIG SLOT ACTIVATE), or at the end of the script.
+  keep_output:
+    description:
+      - Set to false to not return the raw script output of each appliance.
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  concurrency:
+    description:
+      - Maximum number of appliances handled at the same time (default 10).
+  host_timeout:
+    description:
+      - Maximum duration in seconds for one appliance, the appliance is reported as failed when exceeded.
+  cache_dir:
+    description:
+      - Folder of the sns_command result cache, invalidated when the command or script changes the appliances (default ~/.ansible/sns-cache).
+  appliances:
+    description:
+      - list of appliance connection's parameters (name, host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy).
+        Results are keyed by name, or by host if name is not set.
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+'''
+
+EXAMPLES = '''
+- name: Backup all the appliances of the inventory
+  sns_fleet_command:
+    command: "CONFIG BACKUP list=all > /backup/{name}.na"
+    concurrency: 20
+    host_timeout: 600
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+  delegate_to: localhost
+'''
+
+RETURN = '''
+results:
+  description: execution result of each appliance, keyed by appliance name
+  returned: always
+  type: complex
+  sample: |
+    {'appliance1': {'failed': False, 'ret': 100, 'elapsed': 1.2, 'result': '...', 'data': {...}},
+     'appliance2': {'failed': True, 'msg': 'Timeout after 600 seconds', 'elapsed': 600.0}}
+failed_hosts:
+  description: names of the appliances on which the execution failed
+  returned: always
+  type: list
+  sample: ['appliance2']
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_client import appliances_spec, new_client
+from ansible.module_utils.sns_cache import ResultCache, is_modifying
+from ansible.module_utils.sns_fleet import Fleet, appliance_name, client_options
+from ansible.module_utils.sns_script import KEEP_RESULTS, is_command, run_script
+
+def run_appliance(appliance, command, script, expect_disconnect, force_modify, options, deadline,
+                  cache_dir=None, keep_results='failed', keep_output=True, coalesce=False):
+    '''
+    Executes the command or the script on one appliance.
+        Returns:
+                result (dict): execution result of the appliance
+    '''
+    name = appliance_name(appliance)
+    commands = [command] if command is not None else script.splitlines()
+    if any(is_modifying(line) for line in commands if is_command(line)):
+        # cached sns_command results of the appliance are outdated
+        ResultCache(appliance, cache_dir).invalidate()
+    client = new_client(appliance, **options)
+    client.connect()
+
+    try:
+        if force_modify:
+            response = client.send_command("MODIFY FORCE ON")
+            if response.ret >= 200:
+                return {"failed": True, "msg": "Can't take Modify privilege", "result": response.output,
+                        "data": response.parser.serialize_data(), "ret": response.ret}
+
+        if command is not None:
+            response = client.send_command(command.replace("{name}", name))
+            return {"failed": response.ret >= 200, "result": response.output,
+                    "data": response.parser.serialize_data(), "ret": response.ret}
+
+        result = run_script(client, script.replace("{name}", name), expect_disconnect,
+                            keep_results, keep_output, deadline, coalesce)
+        error = result.pop('error')
+        result['failed'] = not result['success']
+        if error is not None:
+            result['msg'] = error
+        elif not result['success']:
+            result["msg"] = "Errors during the script execution"
+        return result
+    finally:
+        client.disconnect()
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "command": {"required": False, "type": "str"},
+            "script": {"required": False, "type": "str"},
+            "expect_disconnect": {"required": False, "type":"bool", "default":False},
+            "force_modify": {"required": False, "type":"bool", "default":False},
+            "keep_results": {"required": False, "type": "str", "default": "failed", "choices": KEEP_RESULTS},
+            "keep_output": {"required": False, "type": "bool", "default": True},
+            "coalesce_activations": {"required": False, "type": "bool", "default": False},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "concurrency": {"required": False, "type": "int", "default": 10},
+            "host_timeout": {"required": False, "type": "int", "default": None},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "appliances": appliances_spec()
+        }
+    )
+
+    command = module.params['command']
+    script = module.params['script']
+    appliances = module.params['appliances']
+
+    if command is None and script is None:
+        module.fail_json(msg="A command or a script is required")
+
+    if command is not None and script is not None:
+        module.fail_json(msg="Got both command and script")
+
+    names = [appliance_name(appliance) for appliance in appliances]
+    if len(set(names)) != len(names):
+        module.fail_json(msg="Appliance names must be unique")
+
+    options = client_options(module.params['timeout'], module.params['host_timeout'])
+
+    def task(appliance, deadline):
+        return run_appliance(appliance, command, script,
+                             module.params['expect_disconnect'],
+                             module.params['force_modify'],
+                             options, deadline, module.params['cache_dir'],
+                             module.params['keep_results'], module.params['keep_output'],
+                             module.params['coalesce_activations'])
+
+    fleet = Fleet(appliances, module.params['concurrency'], module.params['host_timeout'], task)
+    results = dict((names[index], result) for (index, result) in fleet.run().items())
+    failed_hosts = sorted(name for (name, result) in results.items() if result['failed'])
+
+    if failed_hosts:
+        module.fail_json(msg="Errors on {} appliance(s)".format(len(failed_hosts)),
+                         results=results, failed_hosts=failed_hosts)
+    module.exit_json(changed=True, results=results, failed_hosts=failed_hosts)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,9 +39,20 @@ options:
   token:
     description:
       - Token to extract
+  line:
+    description:
+      - Line number to extract from a section in section_line format
   default
     description:
       - Default value to return if token is not found
+  queries:
+    description:
+      - List of values to extract from the same result, each query is a dict with
+        name, section and optional token, line and default. Values are returned in
+        the values dict, keyed by query name.
+  all:
+    description:
+      - Set to true to return the whole parsed result in the config dict.
 author: 
   - Remi Pauchet (@stormshield)
 notes:
@@ -55,6 +66,19 @@ EXAMPLES = '''
     section: Result
     token: Version
   register: myversion
+
+- name: Extract firmware version and model with one parse
+  sns_getconf:
+    result: "{{ sysprop.result }}"
+    queries:
+      - name: version
+        section: Result
+        token: Version
+      - name: model
+        section: Result
+        token: Model
+        default: Unknown
+  register: props
 '''
 
 RETURN = '''
@@ -63,43 +87,78 @@ value:
   returned: changed
   type: string
   sample: 3.7.1
+values:
+  description: Extracted values, keyed by query name
+  returned: when queries are set
+  type: dict
+  sample: {'version': '3.7.1', 'model': 'V50-A'}
+config:
+  description: Whole parsed result
+  returned: when all is set
+  type: dict
+  sample: {'Result': {'Version': '3.7.1', 'Model': 'V50-A'}}
 '''
 
-from stormshield.sns.configparser import ConfigParser, serialize
-
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_client import config_parser
+
+def extract(parser, serialize, section, token=None, line=None, default=None):
+    '''
+    returns the serialized value of a section, a line or a token from the parsed result
+    '''
+    if token is None and line is None:
+        return serialize(parser.get(section=section, default={}))
+    if line is not None:
+        return serialize(parser.get(section=section, line=line, default=default))
+    return serialize(parser.get(section=section, token=token, default=default))
 
 def main():
     module = AnsibleModule(
         argument_spec={
             "result": {"required": True, "type": "str"},
-            "section": {"required": True, "type": "str"},
+            "section": {"required": False, "type": "str"},
             "token": {"required": False, "type": "str"},
             "line": {"required": False, "type": "int"},
-            "default": {"required": False, "type": "str"}
+            "default": {"required": False, "type": "str"},
+            "queries": {
+                "required": False, "type": "list", "elements": "dict",
+                "options": {
+                    "name": {"required": True, "type": "str"},
+                    "section": {"required": True, "type": "str"},
+                    "token": {"required": False, "type": "str"},
+                    "line": {"required": False, "type": "int"},
+                    "default": {"required": False, "type": "str"}
+                }
+            },
+            "all": {"required": False, "type": "bool", "default": False}
         }
     )
 
     result = module.params['result']
     section = module.params['section']
-    token = module.params['token']
-    line = module.params['line']
-    default = module.params['default']
+    queries = module.params['queries']
 
-    if token is None and line is None:
-        module.exit_json(changed=True,
-                         value=serialize(ConfigParser(result).get(section=section,  default={})))
+    if section is None and queries is None and not module.params['all']:
+        module.fail_json(msg="A section, queries or all is required")
 
-    if line is not None:
-        module.exit_json(changed=True,
-                         value=serialize(ConfigParser(result).get(section=section,
-                                                       line=line,
-                                                       default=default)))
-    else:
-        module.exit_json(changed=True,
-                         value=serialize(ConfigParser(result).get(section=section,
-                                                       token=token,
-                                                       default=default)))
+    # the result is parsed once for all the requested values
+    (ConfigParser, serialize) = config_parser()
+    parser = ConfigParser(result)
+    response = {}
+
+    if module.params['all']:
+        response['config'] = parser.serialize_data()
+
+    if queries is not None:
+        response['values'] = dict((query['name'], extract(parser, serialize, query['section'], query['token'],
+                                                          query['line'], query['default']))
+                                  for query in queries)
+
+    if section is not None:
+        response['value'] = extract(parser, serialize, section, module.params['token'],
+                                    module.params['line'], module.params['default'])
+
+    module.exit_json(changed=True, **response)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_job_status
+short_description: Get the progress and the result of a detached SNS task
+description:
+  This module reads the state file of a task started with detach (sns_command, sns_object_import,
+  sns_backup or sns_firmware_update) and returns its progress. Once the task is finished, its result
+  is returned as if the task had not been detached.
+options:
+  job_id:
+    description:
+      - Job id returned by the detached task.
+  job_dir:
+    description:
+      - Folder of the job state files, as set on the detached task (default ~/.ansible/sns-jobs).
+  wait:
+    description:
+      - Maximum number of seconds to wait for the end of the job (default 0, return the current progress).
+  poll_interval:
+    description:
+      - Delay in seconds between two reads of the state file while waiting (default 1).
+  cleanup:
+    description:
+      - Set to true to delete the state file once the job is finished.
+author:
+  - Remi Pauchet (@stormshield)
+'''
+
+EXAMPLES = '''
+- name: Start the backups in the background
+  sns_backup:
+    dest: /backup/sns
+    appliances: "{{ groups['sns_appliances'] | map('extract', hostvars, 'appliance') | list }}"
+    detach: true
+  delegate_to: localhost
+  register: backup_job
+
+- name: Wait for the backups
+  sns_job_status:
+    job_id: "{{ backup_job.job_id }}"
+    cleanup: true
+  delegate_to: localhost
+  register: backup
+  until: backup.finished
+  retries: 60
+  delay: 10
+'''
+
+RETURN = '''
+job_id:
+  description: job id
+  returned: always
+  type: str
+  sample: 4f0d3c0e9a8b4f6d8e1f2a3b4c5d6e7f
+status:
+  description: job status, running, finished or failed
+  returned: always
+  type: str
+  sample: running
+finished:
+  description: True when the job is finished or failed
+  returned: always
+  type: bool
+  sample: False
+progress:
+  description: progress of the job, current command and number of sent commands, uploaded and downloaded bytes,
+               object import status, completed and failed appliances, depending on the module
+  returned: always
+  type: dict
+  sample: {'command': 'SYSTEM UPDATE UPLOAD < /firmware/fwupd-4.3.0.maj', 'commands': 2,
+           'uploaded': 10485760, 'upload_size': 167772160}
+elapsed:
+  description: duration of the job in seconds
+  returned: always
+  type: float
+  sample: 12.3
+'''
+
+import os
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_job import HEARTBEAT, is_alive, job_path, read_job
+
+
+def is_dead(state):
+    '''
+    returns True when the process of a running job exited without writing its result
+    '''
+    age = time.time() - state['updated']
+    if state['pid'] is None:
+        # the process failed before it recorded its pid, the heartbeat never started
+        return age > 3 * HEARTBEAT
+    return age > HEARTBEAT and not is_alive(state['pid'])
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "job_id": {"required": True, "type": "str"},
+            "job_dir": {"required": False, "type": "str", "default": None},
+            "wait": {"required": False, "type": "float", "default": 0},
+            "poll_interval": {"required": False, "type": "float", "default": 1},
+            "cleanup": {"required": False, "type": "bool", "default": False},
+        },
+        supports_check_mode=True
+    )
+
+    try:
+        path = job_path(module.params['job_dir'], module.params['job_id'])
+    except ValueError as exception:
+        module.fail_json(msg=str(exception))
+
+    deadline = time.time() + module.params['wait']
+    while True:
+        try:
+            state = read_job(path)
+        except (IOError, OSError, ValueError) as exception:
+            module.fail_json(msg="Can't read job {}: {}".format(module.params['job_id'], str(exception)))
+        if state['status'] == "running" and is_dead(state):
+            # state written again by the process if it finished meanwhile
+            state = read_job(path)
+            if state['status'] == "running":
+                state['status'] = "failed"
+                process = "Job process {}".format(state['pid']) if state['pid'] is not None else "Job process"
+                state['result'] = {"failed": True, "msg": "{} exited without result".format(process)}
+        if state['status'] != "running" or time.time() + module.params['poll_interval'] > deadline:
+            break
+        time.sleep(module.params['poll_interval'])
+
+    finished = state['status'] != "running"
+    result = {
+        "job_id": state['job_id'],
+        "status": state['status'],
+        "finished": finished,
+        "progress": state.get('progress', {}),
+        "elapsed": round((state.get('finished') or time.time()) - state['started'], 3),
+    }
+    if not finished:
+        module.exit_json(changed=False, **result)
+
+    if module.params['cleanup'] and not module.check_mode:
+        os.unlink(path)
+    # the result of the task, as returned without detach
+    outcome = dict(state.get('result', {}))
+    outcome.update(result)
+    if outcome.get('failed'):
+        outcome.pop('failed')
+        module.fail_json(msg=outcome.pop('msg', "Job failed"), **outcome)
+    module.exit_json(**outcome)
+
+
+if __name__ == '__main__':
+    main()
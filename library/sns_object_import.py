@@ -32,9 +32,48 @@ options:
   force_modify:
     description:
       - Set to true to disconnect other administrator already connected with modify privilege.
+  diff:
+    description:
+      - Set to true to upload only the objects which are missing or different on the appliance.
+        Nothing is uploaded nor activated when all the objects are already up to date.
+  chunk_size:
+    description:
+      - Upload the CSV file in chunks of at most chunk_size objects, imported one after the other in file order.
+        Objects must be defined before the groups which use them, as in the appliance export.
   timeout:
     description:
       - Set the connection and read timeout.
+  poll_interval:
+    description:
+      - First delay in seconds between two import status checks (default 0.5).
+  poll_max_interval:
+    description:
+      - Maximum delay in seconds between two import status checks (default 10).
+  poll_backoff:
+    description:
+      - Factor applied to the delay after each pending import status (default 2).
+  poll_timeout:
+    description:
+      - Maximum duration in seconds of the import activation (default 1800).
+  broker:
+    description:
+      - Send the commands through the local session broker which keeps the appliance session open between tasks.
+  broker_socket:
+    description:
+      - Unix socket of the session broker (default ~/.ansible/sns-broker.sock).
+  broker_idle_timeout:
+    description:
+      - Close broker sessions and stop the broker after this number of seconds without activity (default 300).
+  cache_dir:
+    description:
+      - Folder of the sns_command result cache, invalidated by the import (default ~/.ansible/sns-cache).
+  detach:
+    description:
+      - Set to true to run the import in the background and return its job_id right away. The progress (uploaded bytes,
+        number of imported chunks and last import status) and the result are read with sns_job_status.
+  job_dir:
+    description:
+      - Folder of the job state files (default ~/.ansible/sns-jobs).
   appliance:
     description:
       - appliance connection's parameters (host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy)
@@ -64,14 +103,37 @@ Status:
   returned: changed
   type: str
   sample: 'OK'
+diff:
+  description: number of new, modified and unchanged objects of the CSV file
+  returned: when diff is set
+  type: dict
+  sample: {'new': 2, 'modified': 1, 'unchanged': 931}
+chunks:
+  description: result of each imported chunk, with its source lines, number of lines, import status, number of polls and duration
+  returned: when chunk_size is set
+  type: list
+  sample: [{'index': 0, 'first_line': 2, 'last_line': 1001, 'lines': 1001, 'status': 'OK', 'polls': 3, 'elapsed': 4.1}]
+polling:
+  description: import status polling metrics, number of polls and time to completion in seconds
+  returned: changed
+  type: dict
+  sample: {'polls': 4, 'elapsed': 3.52}
 '''
 
+import csv
+import io
+import os
 import os.path
+import tempfile
 import time
 
-from stormshield.sns.sslclient import SSLClient
-
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_broker import DEFAULT_IDLE_TIMEOUT
+from ansible.module_utils.sns_client import appliance_spec, module_client
+from ansible.module_utils.sns_cache import ResultCache
+from ansible.module_utils.sns_job import detach
+
+DEFAULT_POLLING = {'interval': 0.5, 'max_interval': 10, 'backoff': 2, 'timeout': 1800}
 
 def runCommand(fwConnection,command):
     '''
@@ -85,34 +147,219 @@ def getObjectUploadStatus(fwConnection):
     '''
     return runCommand(fwConnection,"CONFIG OBJECT IMPORT STATUS")
 
-def uploadObjectCSV(fwConnection,objectFilePath):
+def waitObjectImport(fwConnection,polling):
+    '''
+    Polls the object import status until completion with an exponential backoff.
+        Parameters:
+                fwConnection (SSLClient): SNS connection socket initialized outside with SSLClient()
+                polling (dict): interval, max_interval, backoff and timeout in seconds
+        Returns:
+                uploadStatus (dict): the final import status
+                metrics (dict): number of polls and time to completion
+    '''
+    start=time.time()
+    deadline=start+polling['timeout']
+    interval=polling['interval']
+    polls=0
+    while True:
+        currentUploadStatus=getObjectUploadStatus(fwConnection)
+        polls+=1
+        status=currentUploadStatus.data['Result']['Status']
+        if status == "OK":
+            return currentUploadStatus.data['Result'], {'polls': polls, 'elapsed': round(time.time()-start, 3)}
+        if status in ['FAILED' ,'NO IMPORT PENDING']:
+            raise Exception('A problem occured during upload activation : %s' % str(currentUploadStatus.data['Result']))
+        if status != "PENDING":
+            raise Exception('Unexpected upload activation status : %s' % str(currentUploadStatus.data['Result']))
+        if time.time()+interval > deadline:
+            raise Exception('Upload activation still pending after %d seconds (%d polls)' % (polling['timeout'], polls))
+        time.sleep(interval) # wait for completion
+        interval=min(interval*polling['backoff'], polling['max_interval'])
+
+def importObjectCSV(fwConnection,objectFilePath,polling):
+    '''
+    Uploads a CSV file and waits for its import, without activating the object configuration.
+        Returns:
+                uploadStatus (dict): the final upload status
+                metrics (dict): import status polling metrics
+    '''
+    runCommand(fwConnection, "CONFIG OBJECT IMPORT CANCEL") # reset previous erroneous state
+    response=runCommand(fwConnection, "CONFIG OBJECT IMPORT UPLOAD < %s" % (objectFilePath))
+    if response.ret >= 200:
+        raise Exception('Upload rejected : %s' % response.output)
+    runCommand(fwConnection, "CONFIG OBJECT IMPORT ACTIVATE")
+    return waitObjectImport(fwConnection,polling)
+
+def uploadObjectCSV(fwConnection,objectFilePath,polling=DEFAULT_POLLING):
     '''
     Uploads a CSV file to SNS appliance. Returns the final upload status.
         Parameters:
                 fwConnection (SSLClient): SNS connection socket initialized outside with SSLClient()
                 objectFilePath (str): CSV file to upload
+                polling (dict): import status polling parameters
         Returns:
                 uploadStatus (dict): the final upload status
+                metrics (dict): import status polling metrics
     '''
     if os.path.exists(objectFilePath) == False:
       raise Exception("Specified file %s does not exist" %(objectFilePath))
 
-    runCommand(fwConnection, "CONFIG OBJECT IMPORT CANCEL") # reset previous erroneous state
-    runCommand(fwConnection, "CONFIG OBJECT IMPORT UPLOAD < %s" % (objectFilePath))
-    runCommand(fwConnection, "CONFIG OBJECT IMPORT ACTIVATE")
-    currentUploadStatus=getObjectUploadStatus(fwConnection)
-    while True:
-        if currentUploadStatus.data['Result']['Status'] == "OK":
-            uploadStatus=currentUploadStatus.data['Result']
-            runCommand(fwConnection, "CONFIG OBJECT ACTIVATE")
-            break
-        if currentUploadStatus.data['Result']['Status'] in ['FAILED' ,'NO IMPORT PENDING']:
-            raise Exception('A problem occured during upload activation : %s' % str(currentUploadStatus.data['Result']))
-            break
-        if currentUploadStatus.data['Result']['Status'] == "PENDING":
-            time.sleep(2) # wait for completion
-            currentUploadStatus=getObjectUploadStatus(fwConnection)
-    return uploadStatus
+    uploadStatus,metrics=importObjectCSV(fwConnection,objectFilePath,polling)
+    runCommand(fwConnection, "CONFIG OBJECT ACTIVATE")
+    return uploadStatus,metrics
+
+def iterObjectChunks(objectFilePath,chunkSize):
+    '''
+    Streams the CSV file and yields chunks of at most chunkSize objects, in file order.
+    The current header line is repeated at the beginning of each chunk.
+        Yields:
+                firstLine (int), lastLine (int), lines (list)
+    '''
+    with io.open(objectFilePath, 'r', encoding='utf-8', newline='') as source:
+        headerLine=None
+        lines=[]
+        count=0
+        firstLine=None
+        for (number,line) in enumerate(source, 1):
+            if line.strip() == "":
+                continue
+            if line.startswith('#'):
+                headerLine=line
+                lines.append(line)
+                continue
+            if count == 0:
+                firstLine=number
+                if headerLine is not None and (not lines or lines[-1] is not headerLine):
+                    lines.insert(0, headerLine)
+            lines.append(line)
+            count+=1
+            if count == chunkSize:
+                yield firstLine,number,lines
+                lines=[]
+                count=0
+        if count:
+            yield firstLine,number,lines
+
+def mergeUploadStatus(total,uploadStatus):
+    '''
+    adds the object counters of a chunk import status to the total status
+    '''
+    for (k,v) in dict(uploadStatus).items():
+        if k in total and k not in ['Status','Code'] and str(v).isdigit() and str(total[k]).isdigit():
+            total[k]=str(int(total[k])+int(v))
+        else:
+            total[k]=v
+    return total
+
+def uploadObjectCSVChunks(fwConnection,objectFilePath,chunkSize,polling=DEFAULT_POLLING,chunks=None):
+    '''
+    Uploads a CSV file to SNS appliance in chunks of chunkSize objects.
+    Chunks are imported one after the other in file order, so that objects are
+    created before the groups using them, and the configuration is activated once.
+        Parameters:
+                fwConnection (SSLClient): SNS connection socket initialized outside with SSLClient()
+                objectFilePath (str): CSV file to upload
+                chunkSize (int): maximum number of objects per chunk
+                polling (dict): import status polling parameters
+                chunks (list): filled with the result of each imported chunk
+        Returns:
+                uploadStatus (dict): the merged upload status
+                metrics (dict): import status polling metrics
+    '''
+    if os.path.exists(objectFilePath) == False:
+      raise Exception("Specified file %s does not exist" %(objectFilePath))
+    if chunks is None:
+        chunks=[]
+
+    uploadStatus=dict()
+    metrics={'polls': 0, 'elapsed': 0}
+    (fd,chunkPath)=tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        for (index,(firstLine,lastLine,lines)) in enumerate(iterObjectChunks(objectFilePath,chunkSize)):
+            with io.open(chunkPath, 'w', encoding='utf-8', newline='') as target:
+                target.writelines(lines)
+            start=time.time()
+            try:
+                chunkStatus,chunkMetrics=importObjectCSV(fwConnection,chunkPath,polling)
+            except Exception as exception:
+                raise Exception('Chunk %d (lines %d-%d) failed: %s' % (index, firstLine, lastLine, str(exception)))
+            chunks.append({'index': index, 'first_line': firstLine, 'last_line': lastLine,
+                           'lines': len(lines), 'status': chunkStatus['Status'],
+                           'polls': chunkMetrics['polls'], 'elapsed': round(time.time()-start, 3)})
+            metrics['polls']+=chunkMetrics['polls']
+            metrics['elapsed']=round(metrics['elapsed']+chunkMetrics['elapsed'], 3)
+            mergeUploadStatus(uploadStatus,chunkStatus)
+    finally:
+        os.unlink(chunkPath)
+    if not chunks:
+        raise Exception("Specified file %s does not contain any object" %(objectFilePath))
+    runCommand(fwConnection, "CONFIG OBJECT ACTIVATE")
+    return uploadStatus,metrics
+
+def getObjectIndex(fwConnection):
+    '''
+    returns the objects of the appliance indexed by (type, name)
+    '''
+    response=runCommand(fwConnection,"CONFIG OBJECT LIST TYPE=all usage=any")
+    if response.ret >= 200:
+        raise Exception("Can't list appliance objects: %s" % response.output)
+    objectIndex=dict()
+    for obj in response.data.get('Object', []):
+        objectIndex[(obj.get('type', '').lower(), obj.get('name', ''))]=obj
+    return objectIndex
+
+def isObjectUnchanged(row,header,objectIndex):
+    '''
+    a CSV row is unchanged when the appliance object exists with the same value for every column.
+    Columns the appliance does not report are considered different so that the object is uploaded.
+    '''
+    if header is None or len(row) < 2:
+        return False
+    current=objectIndex.get((row[0].strip().lower(), row[1].strip()))
+    if current is None:
+        return False
+    for (column,value) in zip(header[2:],row[2:]):
+        value=value.strip()
+        if column not in current:
+            if value != "":
+                return False
+        elif str(current[column]).strip() != value:
+            return False
+    return True
+
+def buildObjectDiff(objectFilePath,objectIndex,diffFilePath):
+    '''
+    Streams the CSV file and writes the new or modified objects in the diff file.
+    The header line of each block is kept before its first written row.
+        Returns:
+                counts (dict): number of new, modified and unchanged objects
+    '''
+    counts={'new': 0, 'modified': 0, 'unchanged': 0}
+    with io.open(objectFilePath, 'r', encoding='utf-8', newline='') as source, \
+         io.open(diffFilePath, 'w', encoding='utf-8', newline='') as target:
+        header=None
+        headerLine=None
+        for line in source:
+            if line.strip() == "":
+                continue
+            if line.startswith('#'):
+                header=[column.strip() for column in next(csv.reader([line[1:]]))]
+                headerLine=line
+                continue
+            row=next(csv.reader([line]))
+            if isObjectUnchanged(row,header,objectIndex):
+                counts['unchanged']+=1
+                continue
+            if len(row) >= 2 and (row[0].strip().lower(), row[1].strip()) in objectIndex:
+                counts['modified']+=1
+            else:
+                counts['new']+=1
+            if headerLine is not None:
+                target.write(headerLine)
+                headerLine=None
+            target.write(line)
+    return counts
 
 
 def main():
@@ -120,22 +367,20 @@ def main():
         argument_spec={
             "path": {"required": True, "type": "str"},
             "force_modify": {"required": False, "type":"bool", "default":False},
+            "diff": {"required": False, "type":"bool", "default":False},
+            "chunk_size": {"required": False, "type":"int", "default":None},
             "timeout": {"required": False, "type": "int", "default": None},
-            "appliance": {
-                "required": True, "type": "dict",
-                "options": {
-                    "host": {"required": True, "type": "str"},
-                    "ip": {"required": False, "type": "str"},
-                    "port": {"required": False, "type": "int", "default": 443},
-                    "user": {"required": False, "type": "str", "default": "admin"},
-                    "password": {"required": False, "type": "str"},
-                    "sslverifypeer": {"required": False, "type": "bool", "default": True},
-                    "sslverifyhost": {"required": False, "type": "bool", "default": True},
-                    "cabundle": {"required": False, "type": "str"},
-                    "usercert": {"required": False, "type": "str"},
-                    "proxy":  {"required": False, "type": "str"},
-                }
-            }
+            "poll_interval": {"required": False, "type": "float", "default": DEFAULT_POLLING['interval']},
+            "poll_max_interval": {"required": False, "type": "float", "default": DEFAULT_POLLING['max_interval']},
+            "poll_backoff": {"required": False, "type": "float", "default": DEFAULT_POLLING['backoff']},
+            "poll_timeout": {"required": False, "type": "int", "default": DEFAULT_POLLING['timeout']},
+            "broker": {"required": False, "type": "bool", "default": False},
+            "broker_socket": {"required": False, "type": "str", "default": None},
+            "broker_idle_timeout": {"required": False, "type": "int", "default": DEFAULT_IDLE_TIMEOUT},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "detach": {"required": False, "type": "bool", "default": False},
+            "job_dir": {"required": False, "type": "str", "default": None},
+            "appliance": appliance_spec()
         }
     )
 
@@ -145,27 +390,31 @@ def main():
     if path is None:
         module.fail_json(msg="Path of the file is required")
 
-    options = {}
-    if module.params['timeout'] is not None:
-      options["timeout"] = module.params['timeout']
+    polling = {
+        'interval': module.params['poll_interval'],
+        'max_interval': module.params['poll_max_interval'],
+        'backoff': module.params['poll_backoff'],
+        'timeout': module.params['poll_timeout'],
+    }
+    if module.params['chunk_size'] is not None and module.params['chunk_size'] <= 0:
+        module.fail_json(msg="chunk_size must be positive")
+
+    if polling['interval'] <= 0 or polling['backoff'] < 1:
+        module.fail_json(msg="poll_interval must be positive and poll_backoff at least 1")
+
+    try:
+        job = detach(module)
+    except Exception as exception:
+        module.fail_json(msg="Can't start the job: {}".format(str(exception)))
 
     try:
-        client = SSLClient(
-            host=module.params['appliance']['host'],
-            ip=module.params['appliance']['ip'],
-            port=module.params['appliance']['port'],
-            user=module.params['appliance']['user'],
-            password=module.params['appliance']['password'],
-            sslverifypeer=module.params['appliance']['sslverifypeer'],
-            sslverifyhost=module.params['appliance']['sslverifyhost'],
-            cabundle=module.params['appliance']['cabundle'],
-            usercert=module.params['appliance']['usercert'],
-            proxy=module.params['appliance']['proxy'],
-            autoconnect=False,
-            **options)
+        client = module_client(module)
     except Exception as exception:
         module.fail_json(msg=str(exception))
 
+    if job is not None:
+        client = job.client(client)
+
     try:
         client.connect()
     except Exception as exception:
@@ -183,14 +432,37 @@ def main():
                              data=response.parser.serialize_data(), ret=response.ret)
 
     if path is not None:
+        resultJson=dict()
+        uploadPath=path
         try:
-            response = uploadObjectCSV(client,path)
+            if module.params['diff']:
+                if os.path.exists(path) == False:
+                    raise Exception("Specified file %s does not exist" %(path))
+                (fd,uploadPath)=tempfile.mkstemp(suffix='.csv')
+                os.close(fd)
+                # also removed by exit_json when the task is detached
+                module.add_cleanup_file(uploadPath)
+                resultJson['diff']=buildObjectDiff(path,getObjectIndex(client),uploadPath)
+                if resultJson['diff']['new'] + resultJson['diff']['modified'] == 0:
+                    client.disconnect()
+                    module.exit_json(changed=False, Status="OK", output="No object to import", **resultJson)
+            # cached CONFIG OBJECT LIST results are outdated by the import
+            ResultCache(module.params['appliance'], module.params['cache_dir']).invalidate()
+            if module.params['chunk_size'] is not None:
+                resultJson['chunks']=[]
+                response,metrics = uploadObjectCSVChunks(client,uploadPath,module.params['chunk_size'],
+                                                         polling,resultJson['chunks'])
+            else:
+                response,metrics = uploadObjectCSV(client,uploadPath,polling)
         except Exception as exception:
             client.disconnect()
-            module.fail_json(msg=str(exception))
+            module.fail_json(msg=str(exception), **resultJson)
+        finally:
+            if uploadPath != path and os.path.exists(uploadPath):
+                os.unlink(uploadPath)
         client.disconnect()
-        resultJson=dict()
         resultJson['output']=str(response)
+        resultJson['polling']=metrics
         for (k,v) in dict(response).items():
             resultJson[k]=v
         if response['Status'] == "OK":
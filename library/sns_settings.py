@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = '''
+---
+module: sns_settings
+short_description: Declarative configuration of the base settings of a Stormshield Network Security appliance
+description:
+  This module sets the system name, the NTP servers, the DNS servers and the webadmin access list of an appliance.
+  The current settings are read over the same session and only the commands changing them are sent, followed by
+  the activation of the changed subsystems. Nothing is written nor activated when the settings already match.
+  Settings which are not set are left unchanged.
+options:
+  system_name:
+    description:
+      - Name of the appliance.
+  ntp_servers:
+    description:
+      - Host objects of the NTP servers, the other NTP servers are removed.
+  dns_servers:
+    description:
+      - Host objects of the DNS servers in order of preference, the other DNS servers are removed.
+  webadmin_access:
+    description:
+      - Host or network objects allowed to access the administration interface (ie: any), the other ones are removed.
+  force_modify:
+    description:
+      - Set to true to disconnect other administrator already connected with modify privilege.
+        The modify privilege is taken with MODIFY ON otherwise, only when settings are changed.
+  timeout:
+    description:
+      - Set the connection and read timeout.
+  cache_dir:
+    description:
+      - Folder of the sns_command result cache, invalidated when the settings are changed (default ~/.ansible/sns-cache).
+  appliance:
+    description:
+      - appliance connection's parameters (host, port, user, password, sslverifypeer, sslverifyhost, cabundle, usercert, proxy)
+author:
+  - Remi Pauchet (@stormshield)
+notes:
+  - This module requires python-SNS-API library
+  - This module supports check mode and diff mode
+'''
+
+EXAMPLES = '''
+- name: Configure the base settings
+  sns_settings:
+    appliance:
+      host: myappliance.local
+      password: mypassword
+    system_name: appliance1
+    ntp_servers:
+      - fr.pool.ntp.org
+    dns_servers:
+      - dns1
+      - dns2
+    webadmin_access:
+      - any
+    force_modify: true
+  delegate_to: localhost
+'''
+
+RETURN = '''
+commands:
+  description: commands sent, or to be sent in check mode, to apply the settings
+  returned: always
+  type: list
+  sample: ['CONFIG NTP SERVER REMOVE ntp.old', 'CONFIG NTP SERVER ADD name=fr.pool.ntp.org', 'CONFIG NTP ACTIVATE']
+before:
+  description: managed settings before the task
+  returned: always
+  type: dict
+  sample: {'ntp_servers': ['ntp.old']}
+after:
+  description: managed settings after the task
+  returned: always
+  type: dict
+  sample: {'ntp_servers': ['fr.pool.ntp.org']}
+results:
+  description: failed commands
+  returned: when a command failed
+  type: list
+  sample: [{'command': 'CONFIG DNS SERVER ADD dns3', 'ret': 200, 'code': '00500100', 'msg': 'Error', 'data': {}}]
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.sns_cache import ResultCache
+from ansible.module_utils.sns_client import appliance_spec, module_client
+from ansible.module_utils.sns_facts import gather
+from ansible.module_utils.sns_script import run_script
+
+# managed setting: fact subset and function returning its current value from the facts
+SETTINGS = [
+    ("system_name", "system", lambda facts: facts['system'].get('Name')),
+    ("ntp_servers", "ntp", lambda facts: [row['name'] for row in facts['ntp']]),
+    ("dns_servers", "dns", lambda facts: list(facts['dns'].values())),
+    ("webadmin_access", "webadmin", lambda facts: list(facts['webadmin'])),
+]
+
+
+def quote(value):
+    if any(char.isspace() for char in value):
+        return '"{}"'.format(value.replace('"', '\\"'))
+    return value
+
+
+def set_changes(current, desired, remove, add):
+    '''
+    returns the commands removing the unwanted values and adding the missing ones, order is not significant
+    '''
+    commands = [remove.format(quote(value)) for value in current if value not in desired]
+    commands += [add.format(quote(value)) for value in desired if value not in current]
+    return commands
+
+
+def list_changes(current, desired, remove, add):
+    '''
+    returns the commands turning the current list into the desired one, order is significant:
+    values are added at the end, so the longest leading part of the desired list found in order
+    in the current one is kept, the other current values are removed and the rest is added
+    '''
+    kept = 0
+    commands = []
+    for value in current:
+        if kept < len(desired) and value == desired[kept]:
+            kept += 1
+        else:
+            commands.append(remove.format(quote(value)))
+    commands += [add.format(quote(value)) for value in desired[kept:]]
+    return commands
+
+
+def plan(current, desired):
+    '''
+    returns the commands applying the desired settings, each changed subsystem is activated once
+    '''
+    commands = []
+    if desired.get('system_name') is not None and current['system_name'] != desired['system_name']:
+        commands.append("SYSTEM IDENT SystemName={}".format(quote(desired['system_name'])))
+    if desired.get('ntp_servers') is not None:
+        changes = set_changes(current['ntp_servers'], desired['ntp_servers'],
+                              "CONFIG NTP SERVER REMOVE {}", "CONFIG NTP SERVER ADD name={}")
+        if changes:
+            commands += changes + ["CONFIG NTP ACTIVATE"]
+    if desired.get('dns_servers') is not None:
+        changes = list_changes(current['dns_servers'], desired['dns_servers'],
+                               "CONFIG DNS SERVER REMOVE {}", "CONFIG DNS SERVER ADD {}")
+        if changes:
+            commands += changes + ["CONFIG DNS ACTIVATE"]
+    if desired.get('webadmin_access') is not None:
+        changes = set_changes(current['webadmin_access'], desired['webadmin_access'],
+                              "CONFIG WEBADMIN ACCESS REMOVE {}", "CONFIG WEBADMIN ACCESS ADD {}")
+        if changes:
+            commands += changes + ["CONFIG WEBADMIN ACTIVATE"]
+    return commands
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec={
+            "system_name": {"required": False, "type": "str", "default": None},
+            "ntp_servers": {"required": False, "type": "list", "elements": "str", "default": None},
+            "dns_servers": {"required": False, "type": "list", "elements": "str", "default": None},
+            "webadmin_access": {"required": False, "type": "list", "elements": "str", "default": None},
+            "force_modify": {"required": False, "type": "bool", "default": False},
+            "timeout": {"required": False, "type": "int", "default": None},
+            "cache_dir": {"required": False, "type": "str", "default": None},
+            "appliance": appliance_spec()
+        },
+        supports_check_mode=True
+    )
+
+    managed = [(name, subset, read) for (name, subset, read) in SETTINGS if module.params[name] is not None]
+    if not managed:
+        module.fail_json(msg="At least one setting is required")
+    desired = dict((name, module.params[name]) for (name, _, _) in managed)
+
+    try:
+        client = module_client(module)
+        client.connect()
+    except Exception as exception:
+        module.fail_json(msg=str(exception))
+
+    def finish(method, **kwargs):
+        client.disconnect()
+        method(**kwargs)
+
+    try:
+        facts = gather(client, [subset for (_, subset, _) in managed])
+        current = dict((name, read(facts)) for (name, _, read) in managed)
+    except Exception as exception:
+        finish(module.fail_json, msg="Can't read the current settings: {}".format(str(exception)))
+
+    commands = plan(current, desired)
+    result = {"changed": bool(commands), "commands": commands, "before": current,
+              "after": dict(current, **desired)}
+    if module._diff:
+        result['diff'] = {"before": current, "after": result['after']}
+
+    if not commands or module.check_mode:
+        finish(module.exit_json, **result)
+
+    # cached sns_command results of the appliance are outdated
+    ResultCache(module.params['appliance'], module.params['cache_dir']).invalidate()
+
+    # the configuration commands require the modify privilege
+    modify = "MODIFY FORCE ON" if module.params['force_modify'] else "MODIFY ON"
+    try:
+        response = client.send_command(modify)
+    except Exception as exception:
+        finish(module.fail_json, msg="Can't take Modify privilege: {}".format(str(exception)), **result)
+    if response.ret >= 200:
+        finish(module.fail_json, msg="Can't take Modify privilege", modify_result=response.output, **result)
+
+    execution = run_script(client, "\n".join(commands), keep_results='failed', keep_output=False)
+    if execution['error'] is not None:
+        finish(module.fail_json, msg=execution['error'], results=execution['results'], **result)
+    if not execution['success']:
+        finish(module.fail_json, msg="Errors while applying the settings", results=execution['results'], **result)
+    finish(module.exit_json, **result)
+
+
+if __name__ == '__main__':
+    main()
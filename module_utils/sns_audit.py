@@ -0,0 +1,101 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Configuration snapshots hashed per section and per row.
+
+A command result, as serialized by ConfigParser, is reduced to the hash of
+each row (a key/value dict or a list line) and the hash of each section,
+computed over the sorted row hashes or over their sequence for ordered
+sections (ie: filter rules). Two appliances are compared section by section
+and only the sections whose hash differs are diffed row by row.
+'''
+
+import hashlib
+import json
+
+from collections import Counter
+
+
+def digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def rows_of(content):
+    '''
+    returns the rows of a section, a section format result is a single row
+    '''
+    if isinstance(content, list):
+        return content
+    return [content]
+
+
+def strip(row, ignore):
+    if ignore and isinstance(row, dict):
+        return dict((key, value) for (key, value) in row.items() if key not in ignore)
+    return row
+
+
+def snapshot(data, ignore=(), ordered=False):
+    '''
+    returns {section: {"hash": section hash, "rows": [(row hash, row), ...]}} of a serialized result
+    '''
+    sections = {}
+    for (section, content) in data.items():
+        rows = [strip(row, ignore) for row in rows_of(content)]
+        hashed = [(digest(row), row) for row in rows]
+        hashes = [row_hash for (row_hash, _) in hashed]
+        sections[section] = {
+            "hash": digest(hashes if ordered else sorted(hashes)),
+            "rows": hashed,
+        }
+    return sections
+
+
+def section_hashes(sections):
+    return dict((section, content['hash']) for (section, content) in sections.items())
+
+
+def compare(reference, current, max_rows):
+    '''
+    returns the diff of the sections whose hash differs, with at most max_rows missing and extra rows each
+    '''
+    diff = {}
+    for section in sorted(set(reference) | set(current)):
+        expected = reference.get(section, {"hash": None, "rows": []})
+        actual = current.get(section, {"hash": None, "rows": []})
+        if expected['hash'] == actual['hash']:
+            continue
+        expected_count = Counter(row_hash for (row_hash, _) in expected['rows'])
+        actual_count = Counter(row_hash for (row_hash, _) in actual['rows'])
+        missing = _surplus(expected['rows'], expected_count - actual_count)
+        extra = _surplus(actual['rows'], actual_count - expected_count)
+        diff[section] = {
+            "missing": len(missing),
+            "extra": len(extra),
+            "missing_rows": missing[:max_rows],
+            "extra_rows": extra[:max_rows],
+            # same rows in another order, only for ordered sections
+            "reordered": not missing and not extra,
+        }
+    return diff
+
+
+def _surplus(rows, counts):
+    surplus = []
+    for (row_hash, row) in rows:
+        if counts[row_hash] > 0:
+            counts[row_hash] -= 1
+            surplus.append(row)
+    return surplus
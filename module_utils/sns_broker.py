@@ -0,0 +1,444 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Local session broker for the SNS modules.
+
+The broker is a background process started by the first module which needs it.
+It keeps authenticated SSLClient sessions keyed by host, user and port, sends
+NOP commands to keep them alive and closes them after an idle timeout. Modules
+talk to the broker through a Unix socket with BrokerClient, which exposes the
+subset of the SSLClient interface used by the modules.
+
+A session is used by one task at a time: the broker connection of a task holds
+the session until the task disconnects, and the modify privilege taken by the
+task is then released with MODIFY OFF.
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from ansible.module_utils.sns_client import FILE_RE
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser("~"), ".ansible", "sns-broker.sock")
+DEFAULT_IDLE_TIMEOUT = 300
+KEEPALIVE_INTERVAL = 60
+SPAWN_TIMEOUT = 10
+
+MODIFY_RE = re.compile(r'^\s*MODIFY\s+(FORCE\s+)?(ON|OFF)\s*$', re.IGNORECASE)
+
+APPLIANCE_ARGS = ["host", "ip", "port", "user", "password", "sslverifypeer",
+                  "sslverifyhost", "cabundle", "usercert", "proxy"]
+
+
+def session_key(appliance):
+    '''
+    returns the key identifying a session in the broker
+    '''
+    return "{}@{}:{}/{}".format(appliance.get('user'), appliance.get('host'),
+                                appliance.get('port'), appliance.get('ip') or "")
+
+
+def session_secret(appliance, options):
+    '''
+    returns a digest of all connection parameters, used to detect credential changes
+    '''
+    blob = json.dumps([appliance, options], sort_keys=True)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def absolute_command(command):
+    '''
+    make the local file of an upload or download command absolute since the
+    broker does not share the working directory of the module
+    '''
+    match = FILE_RE.match(command)
+    if match is None:
+        return command
+    path = os.path.expanduser(match.group(3))
+    if os.path.isabs(path):
+        return command
+    return "{} {} {}".format(match.group(1), match.group(2), os.path.abspath(path))
+
+
+class _Session(object):
+
+    def __init__(self, appliance, options, secret):
+        self.appliance = appliance
+        self.options = options
+        self.secret = secret
+        self.client = None
+        self.lock = threading.Lock()
+        # held by the broker connection of the task using the session
+        self.owner = threading.Lock()
+        self.modify = False
+        self.last_used = time.time()
+        self.last_keepalive = self.last_used
+
+    def open(self):
+        if self.client is not None:
+            return
+        from stormshield.sns.sslclient import SSLClient
+        kwargs = dict((k, self.appliance.get(k)) for k in APPLIANCE_ARGS)
+        kwargs.update(self.options)
+        client = SSLClient(autoconnect=False, **kwargs)
+        client.connect()
+        self.client = client
+
+    def close(self):
+        if self.client is None:
+            return
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.client = None
+        self.modify = False
+
+
+class SessionBroker(object):
+    '''
+    Unix socket server keeping authenticated SSLClient sessions.
+    Requests and replies are JSON documents, one per line.
+    '''
+
+    def __init__(self, path, idle_timeout=DEFAULT_IDLE_TIMEOUT, keepalive=KEEPALIVE_INTERVAL):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.last_activity = time.time()
+        self.stopped = False
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        server.settimeout(1)
+
+        housekeeping = threading.Thread(target=self._housekeeping)
+        housekeeping.daemon = True
+        housekeeping.start()
+
+        try:
+            while not self.stopped:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                handler = threading.Thread(target=self._handle, args=(conn,))
+                handler.daemon = True
+                handler.start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            with self.lock:
+                sessions = list(self.sessions.values())
+                self.sessions = {}
+            for session in sessions:
+                with session.lock:
+                    session.close()
+
+    def _handle(self, conn):
+        stream = conn.makefile('rwb')
+        # sessions held by this connection
+        held = []
+        try:
+            for line in stream:
+                self.last_activity = time.time()
+                try:
+                    reply = self._dispatch(json.loads(line.decode('utf-8')), held)
+                except Exception as exception:
+                    reply = {"error": str(exception)}
+                stream.write((json.dumps(reply) + "\n").encode('utf-8'))
+                stream.flush()
+                self.last_activity = time.time()
+        finally:
+            stream.close()
+            conn.close()
+            for session in held:
+                self._release(session)
+            self.last_activity = time.time()
+
+    def _acquire(self, appliance, options, held):
+        '''
+        returns the session of the appliance, locked, once it is not used by another task
+        '''
+        while True:
+            session = self._session(appliance, options)
+            if session not in held:
+                session.owner.acquire()
+                held.append(session)
+            session.lock.acquire()
+            with self.lock:
+                if self.sessions.get(session_key(appliance)) is session:
+                    return session
+            # dropped or replaced while waiting, it must not be opened again
+            session.lock.release()
+
+    def _release(self, session):
+        '''
+        give back the modify privilege taken by the task and release the session
+        '''
+        with session.lock:
+            if session.modify and session.client is not None:
+                try:
+                    response = session.client.send_command("MODIFY OFF")
+                    if response.ret >= 200:
+                        raise Exception(response.output)
+                    session.modify = False
+                except Exception:
+                    # the privilege must not leak to the next task
+                    self._drop(session)
+        session.owner.release()
+
+    def _dispatch(self, request, held):
+        op = request.get('op')
+        if op == "open":
+            session = self._acquire(request['appliance'], request['options'], held)
+            try:
+                session.open()
+                constants = dict((k, getattr(session.client, k)) for k in dir(session.client)
+                                 if k.startswith('SRV_RET_'))
+            except Exception as exception:
+                self._drop(session)
+                return {"error": str(exception)}
+            finally:
+                session.lock.release()
+            return {"constants": constants}
+        if op == "command":
+            session = self._acquire(request['appliance'], request['options'], held)
+            try:
+                session.open()
+                response = session.client.send_command(request['command'])
+                session.last_used = time.time()
+                match = MODIFY_RE.match(request['command'])
+                if match is not None and response.ret < 200:
+                    session.modify = match.group(2).upper() == "ON"
+            except Exception as exception:
+                self._drop(session)
+                return {"error": str(exception)}
+            finally:
+                session.lock.release()
+            return {"ret": response.ret, "code": response.code,
+                    "msg": response.msg, "output": response.output}
+        if op == "close":
+            with self.lock:
+                registered = session_key(request['appliance']) in self.sessions
+            if registered:
+                session = self._acquire(request['appliance'], request['options'], held)
+                try:
+                    self._drop(session)
+                finally:
+                    session.lock.release()
+            return {}
+        raise Exception("Unknown broker operation: {}".format(op))
+
+    def _session(self, appliance, options):
+        key = session_key(appliance)
+        secret = session_secret(appliance, options)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None and session.secret == secret:
+                return session
+            new_session = _Session(appliance, options, secret)
+            self.sessions[key] = new_session
+        if session is not None:
+            # connection parameters changed, the previous session is replaced
+            with session.lock:
+                session.close()
+        return new_session
+
+    def _drop(self, session):
+        with self.lock:
+            key = session_key(session.appliance)
+            if self.sessions.get(key) is session:
+                del self.sessions[key]
+        # the caller may already hold the session lock
+        session.close()
+
+    def _housekeeping(self):
+        while not self.stopped:
+            time.sleep(1)
+            now = time.time()
+            with self.lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                if not session.lock.acquire(False):
+                    continue # busy session
+                try:
+                    if session.client is None:
+                        continue
+                    if now - session.last_used > self.idle_timeout:
+                        self._drop(session)
+                    elif now - max(session.last_used, session.last_keepalive) > self.keepalive:
+                        try:
+                            session.client.send_command("NOP")
+                            session.last_keepalive = now
+                        except Exception:
+                            self._drop(session)
+                finally:
+                    session.lock.release()
+            with self.lock:
+                if not self.sessions and now - self.last_activity > self.idle_timeout:
+                    self.stopped = True
+
+
+def _spawn(path, idle_timeout):
+    '''
+    start the broker as a detached process
+    '''
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        os.chdir("/")
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        # release the spawn lock and the pipes of the parent (module or ansible worker)
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+        SessionBroker(path, idle_timeout).serve_forever()
+    finally:
+        os._exit(0)
+
+
+def _connect(path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except socket.error:
+        conn.close()
+        return None
+    return conn
+
+
+def broker_connect(path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    '''
+    returns a socket connected to the broker, the broker is started if needed
+    '''
+    path = path or DEFAULT_SOCKET
+    conn = _connect(path)
+    if conn is not None:
+        return conn
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder, 0o700)
+    lockfd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lockfd, fcntl.LOCK_EX)
+        # another module may have started the broker while we were waiting
+        conn = _connect(path)
+        if conn is not None:
+            return conn
+        _spawn(path, idle_timeout)
+        deadline = time.time() + SPAWN_TIMEOUT
+        while time.time() < deadline:
+            conn = _connect(path)
+            if conn is not None:
+                return conn
+            time.sleep(0.05)
+    finally:
+        fcntl.flock(lockfd, fcntl.LOCK_UN)
+        os.close(lockfd)
+    raise Exception("Can't start session broker on {}".format(path))
+
+
+class BrokerResponse(object):
+    '''
+    command response relayed by the broker, mimics SSLClient responses
+    '''
+
+    def __init__(self, reply):
+        self.ret = reply['ret']
+        self.code = reply['code']
+        self.msg = reply['msg']
+        self.output = reply['output']
+        from ansible.module_utils.sns_client import config_parser
+        (ConfigParser, _) = config_parser()
+        self.parser = ConfigParser(self.output)
+        self.data = self.parser.data
+
+
+class BrokerClient(object):
+    '''
+    SSLClient replacement sending the commands through the session broker.
+    disconnect() only releases the broker connection, the appliance session
+    is kept open for the next tasks.
+    '''
+
+    def __init__(self, appliance, options=None, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.appliance = dict((k, appliance.get(k)) for k in APPLIANCE_ARGS)
+        self.options = options or {}
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.conn = None
+        self.stream = None
+
+    def _call(self, request):
+        request['appliance'] = self.appliance
+        request['options'] = self.options
+        self.stream.write((json.dumps(request) + "\n").encode('utf-8'))
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise Exception("Session broker disconnected")
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            raise Exception(reply['error'])
+        return reply
+
+    def connect(self):
+        self.conn = broker_connect(self.path, self.idle_timeout)
+        self.stream = self.conn.makefile('rwb')
+        reply = self._call({"op": "open"})
+        for (k, v) in reply['constants'].items():
+            setattr(self, k, v)
+
+    def send_command(self, command):
+        return BrokerResponse(self._call({"op": "command", "command": absolute_command(command)}))
+
+    def close_session(self):
+        '''
+        close the appliance session kept by the broker
+        '''
+        self._call({"op": "close"})
+
+    def disconnect(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,175 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Controller side cache of read-only command results.
+
+Entries are JSON files stored in one folder per appliance (host, port and
+user) and keyed by the normalized command, or by another key (ie: the
+sns_audit section hashes). Only the commands matching
+READONLY_PREFIXES are cached, any other command sent to an appliance
+invalidates all its entries.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".ansible", "sns-cache")
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# read-only command prefixes and their default time to live in seconds
+READONLY_PREFIXES = [
+    ("SYSTEM PROPERTY", 3600),
+    ("HA INFO", 30),
+    ("HA CLUSTER LIST", 300),
+    ("CONFIG NTP SERVER LIST", 300),
+    ("CONFIG DNS SERVER LIST", 300),
+    ("CONFIG WEBADMIN ACCESS SHOW", 300),
+    ("CONFIG OBJECT LIST", 300),
+    ("CONFIG SLOT LIST", 300),
+    ("CONFIG FILTER EXPLICIT", 300),
+    ("VERSION", 3600),
+    ("HELP", 3600),
+]
+
+# commands which do not change the appliance configuration
+NEUTRAL_PREFIXES = ["MODIFY", "NOP", "QUIT", "LIST", "CHPWD", "AUTH"]
+
+
+def normalize(command):
+    '''
+    returns the command with collapsed white spaces
+    '''
+    return " ".join(command.split())
+
+
+def _match(command, prefix):
+    command = normalize(command).upper()
+    return command == prefix or command.startswith(prefix + " ")
+
+
+def readonly_ttl(command):
+    '''
+    returns the default time to live of a read-only command, None for other commands
+    '''
+    if '<' in command or '>' in command:
+        # file upload or download
+        return None
+    for (prefix, ttl) in READONLY_PREFIXES:
+        if _match(command, prefix):
+            return ttl
+    return None
+
+
+def is_modifying(command):
+    '''
+    returns True if the command may change the appliance state
+    '''
+    if readonly_ttl(command) is not None:
+        return False
+    return not any(_match(command, prefix) for prefix in NEUTRAL_PREFIXES)
+
+
+class ResultCache(object):
+
+    def __init__(self, appliance, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.root = path or DEFAULT_CACHE_DIR
+        self.max_size = max_size
+        key = "{}@{}:{}".format(appliance.get('user'), appliance.get('host'), appliance.get('port'))
+        self.folder = os.path.join(self.root, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _entry(self, command):
+        digest = hashlib.sha256(normalize(command).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest + ".json")
+
+    def get(self, command):
+        '''
+        returns the cached response dict (ret, code, msg, output) or None
+        '''
+        return self.get_entry(command)
+
+    def set(self, command, response, ttl):
+        self.set_entry(command, {"ret": response.ret, "code": response.code,
+                                 "msg": response.msg, "output": response.output}, ttl)
+
+    def get_entry(self, key):
+        '''
+        returns the cached value of a command or of another key, None when missing or expired
+        '''
+        entry = self._entry(key)
+        try:
+            with open(entry) as cached:
+                content = json.load(cached)
+        except (IOError, OSError, ValueError):
+            return None
+        if content.get('command') != normalize(key) or time.time() > content['expires']:
+            return None
+        return content['response']
+
+    def set_entry(self, key, value, ttl):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder, 0o700)
+        content = {
+            "command": normalize(key),
+            "expires": time.time() + ttl,
+            "response": value,
+        }
+        # atomic replacement, concurrent tasks may read the same entry
+        (fd, tmp) = tempfile.mkstemp(dir=self.folder)
+        with os.fdopen(fd, 'w') as target:
+            json.dump(content, target)
+        os.rename(tmp, self._entry(key))
+        self.evict()
+
+    def invalidate(self):
+        '''
+        removes all the entries of the appliance
+        '''
+        if not os.path.isdir(self.folder):
+            return
+        trash = "{}.{}.deleted".format(self.folder, os.getpid())
+        try:
+            os.rename(self.folder, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self):
+        '''
+        removes the oldest entries of all appliances until the cache fits in max_size
+        '''
+        entries = []
+        total = 0
+        for (folder, _, files) in os.walk(self.root):
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for (_, size, path) in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
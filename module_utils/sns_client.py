@@ -0,0 +1,173 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Client factory shared by the SNS modules.
+
+The appliance argument spec and the client construction are defined once.
+The python-SNS-API library (and requests behind it) is imported on first use
+only, so that a task failing the argument validation or answered from the
+result cache does not pay for it.
+
+When the SNS_STARTUP_TRACE environment variable is set to a file path, each
+client creation appends a JSON line with the module name, the age of the
+process, the time spent since this file was imported and the duration of the
+lazy imports, ie: the startup cost of the task before its first connection.
+'''
+
+import copy
+import importlib
+import os
+import re
+import sys
+import threading
+import time
+
+LOADED = time.time()
+
+# upload (<) or download (>) of a local file, as matched by SSLClient: an
+# operator followed by a quote is part of a quoted value, not a redirection
+FILE_RE = re.compile(r'^(.+?)\s*([<>])\s*(?!.*")(\S.*?)\s*$')
+
+APPLIANCE_OPTIONS = {
+    "host": {"required": True, "type": "str"},
+    "ip": {"required": False, "type": "str"},
+    "port": {"required": False, "type": "int", "default": 443},
+    "user": {"required": False, "type": "str", "default": "admin"},
+    "password": {"required": False, "type": "str"},
+    "sslverifypeer": {"required": False, "type": "bool", "default": True},
+    "sslverifyhost": {"required": False, "type": "bool", "default": True},
+    "cabundle": {"required": False, "type": "str"},
+    "usercert": {"required": False, "type": "str"},
+    "proxy":  {"required": False, "type": "str"},
+}
+
+_imports = {}
+_import_lock = threading.Lock()
+
+
+def appliance_spec(**options):
+    '''
+    returns the argument spec of the appliance parameter, with additional options
+    '''
+    spec = copy.deepcopy(APPLIANCE_OPTIONS)
+    spec.update(options)
+    return {"required": True, "type": "dict", "options": spec}
+
+
+def appliances_spec(**options):
+    '''
+    returns the argument spec of the appliances parameter of the fleet modules
+    '''
+    spec = copy.deepcopy(APPLIANCE_OPTIONS)
+    spec["name"] = {"required": False, "type": "str"}
+    spec.update(options)
+    return {"required": True, "type": "list", "elements": "dict", "options": spec}
+
+
+def _timed_import(name):
+    # the fleet workers create their clients at the same time, a module being
+    # imported by another thread must not be returned before it is initialized
+    with _import_lock:
+        loaded = name in sys.modules
+        start = time.time()
+        module = importlib.import_module(name)
+        if not loaded:
+            _imports[name] = round(time.time() - start, 6)
+    return module
+
+
+def ssl_client_class():
+    return _timed_import("stormshield.sns.sslclient").SSLClient
+
+
+def config_parser():
+    '''
+    returns the ConfigParser class and the serialize function
+    '''
+    module = _timed_import("stormshield.sns.configparser")
+    return module.ConfigParser, module.serialize
+
+
+def _process_age():
+    '''
+    returns the age in seconds of the current process (Linux only), None otherwise
+    '''
+    try:
+        with open("/proc/self/stat") as source:
+            # the command name may contain spaces, fields are counted after it
+            start_ticks = float(source.read().rsplit(')', 1)[1].split()[19])
+        with open("/proc/uptime") as source:
+            uptime = float(source.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 3)
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def _trace_startup():
+    path = os.environ.get("SNS_STARTUP_TRACE")
+    if not path:
+        return
+    from ansible.module_utils.sns_timings import write_trace
+    try:
+        write_trace(path, {
+            "time": time.time(),
+            "module": os.path.basename(getattr(sys.modules.get('__main__'), '__file__', None) or sys.argv[0]),
+            "pid": os.getpid(),
+            "process_age": _process_age(),
+            "since_import": round(time.time() - LOADED, 6),
+            "imports": dict(_imports),
+        })
+    except (IOError, OSError):
+        pass
+
+
+def new_client(appliance, timeout=None, broker=False, broker_socket=None, broker_idle_timeout=None):
+    '''
+    returns a client of the appliance, not connected yet. With broker, the client
+    talks to the local session broker instead of the appliance.
+    '''
+    options = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+
+    if broker:
+        from ansible.module_utils.sns_broker import BrokerClient, DEFAULT_IDLE_TIMEOUT
+        client = BrokerClient(appliance, options, path=broker_socket,
+                              idle_timeout=broker_idle_timeout or DEFAULT_IDLE_TIMEOUT)
+    else:
+        client = ssl_client_class()(
+            host=appliance['host'],
+            ip=appliance['ip'],
+            port=appliance['port'],
+            user=appliance['user'],
+            password=appliance['password'],
+            sslverifypeer=appliance['sslverifypeer'],
+            sslverifyhost=appliance['sslverifyhost'],
+            cabundle=appliance['cabundle'],
+            usercert=appliance['usercert'],
+            proxy=appliance['proxy'],
+            autoconnect=False,
+            **options)
+    _trace_startup()
+    return client
+
+
+def module_client(module):
+    '''
+    returns the client described by the appliance, timeout and broker parameters of a module
+    '''
+    params = module.params
+    return new_client(params['appliance'], params.get('timeout'), params.get('broker', False),
+                      params.get('broker_socket'), params.get('broker_idle_timeout'))
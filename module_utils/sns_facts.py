@@ -0,0 +1,109 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Appliance facts gathered over a single session.
+
+Each fact subset runs its read-only commands and keeps the relevant sections
+of the parsed result. Subsets are selected as with the Ansible setup module:
+'all', subset names and '!name' exclusions.
+'''
+
+import time
+
+from collections import OrderedDict
+
+
+def _data(client, command):
+    response = client.send_command(command)
+    if response.ret >= 200:
+        raise Exception("{} failed: {}".format(command, response.output))
+    return response.parser.serialize_data()
+
+
+def gather_system(client):
+    return _data(client, "SYSTEM PROPERTY").get('Result', {})
+
+
+def gather_ha(client):
+    # HA INFO fails on an appliance which is not a cluster member
+    response = client.send_command("HA INFO")
+    if response.ret >= 200:
+        return {"enabled": False}
+    return {"enabled": True, "info": response.parser.serialize_data(),
+            "members": _data(client, "HA CLUSTER LIST").get('HA', [])}
+
+
+def gather_ntp(client):
+    return _data(client, "CONFIG NTP SERVER LIST").get('Result', [])
+
+
+def gather_dns(client):
+    return _data(client, "CONFIG DNS SERVER LIST").get('Server', {})
+
+
+def gather_webadmin(client):
+    return _data(client, "CONFIG WEBADMIN ACCESS SHOW LIST").get('Result', [])
+
+
+SUBSETS = OrderedDict([
+    ("system", gather_system),
+    ("ha", gather_ha),
+    ("ntp", gather_ntp),
+    ("dns", gather_dns),
+    ("webadmin", gather_webadmin),
+])
+
+
+def resolve_subsets(requested):
+    '''
+    returns the ordered list of subset names selected by the gather_subset values
+    '''
+    selected = set()
+    excluded = set()
+    for name in requested:
+        exclude = name.startswith('!')
+        name = name.lstrip('!')
+        if name == 'all':
+            names = list(SUBSETS.keys())
+        elif name in SUBSETS:
+            names = [name]
+        else:
+            raise ValueError("Unknown fact subset {}, expected one of: all, {}".format(
+                name, ", ".join(SUBSETS.keys())))
+        (excluded if exclude else selected).update(names)
+    if not selected and excluded:
+        selected = set(SUBSETS.keys())
+    return [name for name in SUBSETS if name in selected and name not in excluded]
+
+
+def gather(client, subsets):
+    '''
+    returns the facts of the selected subsets with the gathering timestamp
+    '''
+    facts = dict((name, SUBSETS[name](client)) for name in subsets)
+    facts['subsets'] = list(subsets)
+    facts['gathered_at'] = time.time()
+    return facts
+
+
+def is_fresh(facts, subsets, max_age):
+    '''
+    returns True when previously gathered facts include all the subsets and are younger than max_age seconds
+    '''
+    if not facts or max_age is None or 'gathered_at' not in facts:
+        return False
+    if not set(subsets).issubset(facts.get('subsets', [])):
+        return False
+    return time.time() - float(facts['gathered_at']) < max_age
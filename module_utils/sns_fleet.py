@@ -0,0 +1,107 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Parallel execution of a task on a list of appliances.
+'''
+
+import threading
+import time
+
+from ansible.module_utils.sns_script import ScriptTimeout
+
+
+def appliance_name(appliance):
+    '''
+    returns the name of an appliance, its host if the name is not set
+    '''
+    return appliance['name'] if appliance.get('name') is not None else appliance['host']
+
+
+def client_options(timeout, host_timeout):
+    '''
+    returns the SSLClient options of the fleet connections
+    '''
+    options = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    elif host_timeout is not None:
+        # a blocked read must not outlive the host timeout
+        options["timeout"] = host_timeout
+    return options
+
+
+class Fleet(object):
+    '''
+    Bounded pool of daemon workers running task(appliance, deadline) for each
+    appliance. A worker exceeding the host timeout is abandoned and replaced so
+    that the other appliances keep progressing. Results are keyed by index.
+    '''
+
+    def __init__(self, appliances, concurrency, host_timeout, task):
+        self.appliances = appliances
+        self.concurrency = max(1, concurrency)
+        self.host_timeout = host_timeout
+        self.task = task
+        self.lock = threading.Lock()
+        self.pending = list(range(len(appliances)))
+        self.started = {}
+        self.results = {}
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                index = self.pending.pop(0)
+                self.started[index] = time.time()
+            deadline = None
+            if self.host_timeout is not None:
+                deadline = self.started[index] + self.host_timeout
+            try:
+                result = self.task(self.appliances[index], deadline)
+            except ScriptTimeout:
+                result = {"failed": True, "msg": "Timeout after {} seconds".format(self.host_timeout)}
+            except Exception as exception:
+                result = {"failed": True, "msg": str(exception)}
+            with self.lock:
+                if index in self.results:
+                    # timed out and abandoned by the pool
+                    return
+                result["elapsed"] = round(time.time() - self.started[index], 3)
+                self.results[index] = result
+
+    def _spawn(self):
+        worker = threading.Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+
+    def run(self):
+        for _ in range(min(self.concurrency, len(self.appliances))):
+            self._spawn()
+        while True:
+            with self.lock:
+                if len(self.results) == len(self.appliances):
+                    return self.results
+                if self.host_timeout is not None:
+                    now = time.time()
+                    for (index, started) in self.started.items():
+                        if index not in self.results and now - started > self.host_timeout:
+                            self.results[index] = {
+                                "failed": True,
+                                "msg": "Timeout after {} seconds".format(self.host_timeout),
+                                "elapsed": round(now - started, 3)}
+                            if self.pending:
+                                self._spawn()
+            time.sleep(0.1)
@@ -0,0 +1,282 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Detached execution of the long running SNS tasks.
+
+With the detach parameter, the module forks a background process once its
+arguments are validated and returns the job id right away. The background
+process runs the task as usual, its progress and its final result are
+written to a JSON state file (one per job, in ~/.ansible/sns-jobs by
+default) which is read by the sns_job_status module.
+
+The state file is replaced atomically when the progress changes and at
+least every HEARTBEAT seconds, so that the status module can tell a running
+job from a job whose process died.
+'''
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from ansible.module_utils.sns_client import FILE_RE
+
+DEFAULT_JOB_DIR = os.path.join(os.path.expanduser("~"), ".ansible", "sns-jobs")
+HEARTBEAT = 2
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def job_path(job_dir, job_id):
+    if not JOB_ID_RE.match(job_id):
+        raise ValueError("Invalid job id {}".format(job_id))
+    return os.path.join(os.path.expanduser(job_dir or DEFAULT_JOB_DIR), job_id + ".json")
+
+
+def read_job(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class CountingReader(object):
+    '''
+    file-like upload body counting the bytes read by the HTTP client
+    '''
+
+    def __init__(self, source, callback):
+        self.source = source
+        self.callback = callback
+        self.len = getattr(source, 'len', None)
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        self.callback(len(chunk))
+        return chunk
+
+
+class ProgressClient(object):
+    '''
+    Wraps an SNS client and reports the current command, the number of sent
+    commands, the uploaded and downloaded bytes and the last object import
+    status to the job.
+    '''
+
+    def __init__(self, client, job):
+        self.client = client
+        self.job = job
+        self._hooked = False
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _uploaded(self, size):
+        self.job.add(uploaded=size)
+
+    def _attach(self):
+        # SSLClient streams the uploads as a request body read by chunks
+        session = getattr(self.client, 'session', None)
+        if self._hooked or session is None:
+            return
+        post = session.post
+
+        def counting_post(url, data=None, **kwargs):
+            if hasattr(data, 'read'):
+                data = CountingReader(data, self._uploaded)
+                # the multipart encoded size, as the counted bytes, not the file size
+                self.job.update(uploaded=0, upload_size=data.len)
+            return post(url, data=data, **kwargs)
+
+        session.post = counting_post
+        self._hooked = True
+
+    def connect(self):
+        self.client.connect()
+        self._attach()
+
+    def send_command(self, command):
+        progress = {"command": command, "commands": self.job.progress.get('commands', 0) + 1}
+        match = FILE_RE.match(command)
+        if match is not None and match.group(2) == '<':
+            # set when the upload request starts
+            progress.update(uploaded=0, upload_size=None)
+        elif match is not None:
+            # downloaded bytes are read from the target file by the heartbeat
+            self.job.watch = os.path.expanduser(match.group(3))
+        self.job.update(**progress)
+        try:
+            response = self.client.send_command(command)
+        finally:
+            self.job.watch = None
+        if match is not None and match.group(2) == '>':
+            self.job.update(downloaded=_file_size(os.path.expanduser(match.group(3))))
+        if " ".join(command.split()).upper() == "CONFIG OBJECT IMPORT STATUS" and response.ret < 200:
+            self.job.update(import_status=response.parser.get(section='Result', token='Status'))
+        elif " ".join(command.split()).upper().startswith("CONFIG OBJECT IMPORT UPLOAD"):
+            self.job.update(imports=self.job.progress.get('imports', 0) + 1)
+        return response
+
+    def disconnect(self):
+        self.client.disconnect()
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Job(object):
+
+    def __init__(self, path, module_name):
+        self.path = path
+        self.lock = threading.Lock()
+        self.progress = {}
+        self.watch = None
+        self.state = {"job_id": os.path.basename(path)[:-5], "module": module_name, "pid": None,
+                      "status": "running", "started": time.time(), "updated": None}
+
+    def write(self):
+        with self.lock:
+            if self.watch is not None:
+                self.progress['downloaded'] = _file_size(self.watch)
+            self.state['updated'] = time.time()
+            self.state['progress'] = dict(self.progress)
+            (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(fd, 'w') as target:
+                json.dump(self.state, target, sort_keys=True)
+            os.rename(tmp, self.path)
+
+    def update(self, **progress):
+        with self.lock:
+            self.progress.update(progress)
+        self.write()
+
+    def add(self, **counters):
+        # called for each uploaded chunk, written by the heartbeat
+        with self.lock:
+            for (name, value) in counters.items():
+                self.progress[name] = self.progress.get(name, 0) + value
+
+    def client(self, client):
+        return ProgressClient(client, self)
+
+    def track(self, task, appliances):
+        '''
+        returns the fleet task counting the completed and failed appliances
+        '''
+        self.update(appliances=len(appliances), done=0, failed=0)
+
+        def tracked(appliance, deadline):
+            try:
+                result = task(appliance, deadline)
+            except Exception:
+                self.add(done=1, failed=1)
+                raise
+            self.add(done=1, failed=1 if result.get('failed') else 0)
+            return result
+        return tracked
+
+    def finish(self, result):
+        self.state['status'] = "failed" if result.get('failed') else "finished"
+        self.state['finished'] = time.time()
+        self.state['result'] = result
+        self.write()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT)
+            try:
+                self.write()
+            except (IOError, OSError):
+                pass
+
+
+def detach(module):
+    '''
+    Forks the task in the background when the detach parameter is set.
+    The foreground process exits the module with the job id and the state file,
+    the background process gets the Job and goes on with the task.
+        Returns:
+                job (Job): job of the background process, None when the task is not detached
+    '''
+    if not module.params.get('detach') or module.check_mode:
+        return None
+
+    job_dir = os.path.expanduser(module.params.get('job_dir') or DEFAULT_JOB_DIR)
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir, 0o700)
+    job_id = uuid.uuid4().hex
+    job = Job(job_path(job_dir, job_id), module._name)
+    job.write()
+
+    # the module payload is removed once the foreground process returns,
+    # the lazily imported dependencies are loaded now
+    from ansible.module_utils.basic import remove_values
+    from ansible.module_utils.sns_client import config_parser, ssl_client_class
+    import ansible.module_utils.sns_timings
+    ssl_client_class()
+    config_parser()
+
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        # nothing is changed yet, the result of the task is returned by sns_job_status
+        module.exit_json(changed=False, started=True, finished=False, job_id=job_id, job_file=job.path)
+
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+
+    def exit_json(**result):
+        result.setdefault('changed', False)
+        job.finish(remove_values(result, module.no_log_values))
+        # the finally blocks of the task are not run by os._exit
+        module.do_cleanup_files()
+        os._exit(0)
+
+    def fail_json(msg, **result):
+        result.update(failed=True, msg=msg)
+        exit_json(**result)
+
+    def excepthook(kind, value, traceback):
+        fail_json("{}: {}".format(kind.__name__, str(value)))
+
+    module.exit_json = exit_json
+    module.fail_json = fail_json
+    sys.excepthook = excepthook
+
+    job.state['pid'] = os.getpid()
+    job.write()
+    heartbeat = threading.Thread(target=job._heartbeat)
+    heartbeat.daemon = True
+    heartbeat.start()
+    return job
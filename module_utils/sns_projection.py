@@ -0,0 +1,110 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Projection of parsed command results.
+
+Sections, fields and rows are selected on the parsed data before its
+serialization, and the rows can be written or appended to a local JSON Lines
+file instead of being returned by the module.
+'''
+
+import json
+import os
+import tempfile
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+def _match(row, where):
+    return all(str(row.get(field)) == str(value) for (field, value) in where.items())
+
+
+def _select(row, fields):
+    if not fields:
+        return row
+    return dict((field, row[field]) for field in fields if field in row)
+
+
+def project(data, sections=None, fields=None, where=None):
+    '''
+    returns the selected sections of the parsed data, with the selected fields
+    of the rows matching all the where conditions
+    '''
+    projected = {}
+    for (section, content) in data.items():
+        if sections and section not in sections:
+            continue
+        if isinstance(content, Mapping):
+            # section format, the section is a single row
+            if where and not _match(content, where):
+                continue
+            projected[section] = _select(content, fields)
+        elif isinstance(content, list):
+            projected[section] = [_select(row, fields) if isinstance(row, Mapping) else row
+                                  for row in content
+                                  if not where or (isinstance(row, Mapping) and _match(row, where))]
+        else:
+            projected[section] = content
+    return projected
+
+
+def iter_rows(data, **extra):
+    '''
+    yields one record per row of the parsed data with its section name and the extra fields
+    '''
+    for (section, content) in data.items():
+        rows = content if isinstance(content, list) else [content]
+        for row in rows:
+            if isinstance(row, Mapping):
+                record = dict(row)
+            else:
+                record = {"value": row}
+            record['section'] = section
+            record.update(extra)
+            yield record
+
+
+def write_rows(path, data):
+    '''
+    writes one JSON line per row with its section name and returns the number of rows per section
+    '''
+    path = os.path.expanduser(path)
+    counts = dict((section, 0) for section in data)
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as target:
+            for record in iter_rows(data):
+                target.write(json.dumps(record) + "\n")
+                counts[record['section']] += 1
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return counts
+
+
+def append_rows(target, data, **extra):
+    '''
+    appends one JSON line per row to an open file and returns the number of written rows
+    '''
+    count = 0
+    for record in iter_rows(data, **extra):
+        target.write(json.dumps(record) + "\n")
+        count += 1
+    target.flush()
+    return count
@@ -0,0 +1,158 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Script execution engine shared by the SNS modules.
+
+Scripts do not stop on the first error. The raw output is collected in a list
+and joined once, and the structured result of each command can be kept for
+all commands, only for the failed ones or not at all to bound the memory used
+by huge scripts.
+
+With activation coalescing, the CONFIG <subsystem> ACTIVATE commands are
+deferred and each subsystem is activated once. Pending activations are sent
+in their first occurrence order before any barrier command (commands outside
+CONFIG and activations with parameters such as CONFIG SLOT ACTIVATE) and at
+the end of the script.
+'''
+
+import re
+import time
+
+EMPTY_RE = re.compile(r'^\s*$')
+
+KEEP_RESULTS = ['all', 'failed', 'none']
+
+ACTIVATE_RE = re.compile(r'^\s*CONFIG\s+(\S+)\s+ACTIVATE\s*$', re.IGNORECASE)
+
+
+class ScriptTimeout(Exception):
+    pass
+
+
+def is_command(line):
+    '''
+    returns False for comments and empty lines
+    '''
+    return not line.startswith('#') and not EMPTY_RE.match(line)
+
+
+def activation_subsystem(command):
+    '''
+    returns the subsystem of a plain CONFIG <subsystem> ACTIVATE command, None otherwise
+    '''
+    match = ACTIVATE_RE.match(command)
+    return match.group(1).upper() if match else None
+
+
+def is_barrier(command):
+    '''
+    commands which may depend on the previous activations: any command outside
+    CONFIG and the activations with parameters (ie: CONFIG SLOT ACTIVATE type=filter slot=9)
+    '''
+    words = command.split()
+    if not words or words[0].upper() != "CONFIG":
+        return True
+    return "ACTIVATE" in [word.upper() for word in words] and activation_subsystem(command) is None
+
+
+def run_script(client, script, expect_disconnect=False, keep_results='failed', keep_output=True,
+               deadline=None, coalesce=False):
+    '''
+    Executes a script line by line.
+        Parameters:
+                client (SSLClient): connected SNS client
+                script (str): configuration script
+                expect_disconnect (bool): stop without error when the server disconnects
+                keep_results (str): structured results to keep, all, failed or none
+                keep_output (bool): build the raw script output
+                deadline (float): raise ScriptTimeout when reached before a command
+                coalesce (bool): defer the CONFIG <subsystem> ACTIVATE commands and send
+                                 each of them once, before the next barrier command or
+                                 at the end of the script
+        Returns:
+                result (dict): success, need_reboot, error, output, results and activations
+                               (with the pending activations not sent after an error)
+    '''
+    output = []
+    results = []
+    state = {"success": True, "need_reboot": False}
+    deferred = []
+    subsystems = set()
+    activations = {"deferred": 0, "sent": 0}
+
+    def send(command, echo, is_deferred=False):
+        if keep_output and echo:
+            output.append(command + "\n")
+        response = client.send_command(command)
+        if keep_output:
+            output.append(response.output + "\n")
+        failed = response.ret >= 200
+        if failed:
+            state['success'] = False
+        elif response.ret == client.SRV_RET_MUSTREBOOT:
+            state['need_reboot'] = True
+        if keep_results == 'all' or (keep_results == 'failed' and failed):
+            entry = {"command": command, "ret": response.ret, "code": response.code,
+                     "msg": response.msg, "data": response.parser.serialize_data()}
+            if is_deferred:
+                entry['deferred'] = True
+            results.append(entry)
+
+    def flush():
+        while deferred:
+            send(deferred[0], True, True)
+            deferred.pop(0)
+            activations['sent'] += 1
+        subsystems.clear()
+
+    error = None
+    try:
+        for command in script.splitlines():
+            command = command.strip('\r\n')
+            if not is_command(command):
+                if keep_output:
+                    output.append(command + "\n")
+                continue
+            if deadline is not None and time.time() > deadline:
+                raise ScriptTimeout()
+            if coalesce:
+                subsystem = activation_subsystem(command)
+                if subsystem is not None:
+                    activations['deferred'] += 1
+                    if subsystem not in subsystems:
+                        subsystems.add(subsystem)
+                        deferred.append(command.strip())
+                    continue
+                if is_barrier(command):
+                    flush()
+            send(command, True)
+        flush()
+    except ScriptTimeout:
+        raise
+    except Exception as exception:
+        if not (expect_disconnect and str(exception) == "Server disconnected"):
+            state['success'] = False
+            error = str(exception)
+
+    result = {"success": state['success'], "need_reboot": state['need_reboot'], "error": error}
+    if keep_output:
+        result['output'] = "".join(output)
+    if keep_results != 'none':
+        result['results'] = results
+    if coalesce:
+        # activations still pending when the script stopped on an error
+        activations['not_sent'] = list(deferred)
+        result['activations'] = activations
+    return result
@@ -0,0 +1,152 @@
+# Copyright: (c) 2018, Stormshield https://www.stormshield.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Latency instrumentation of the SNS client.
+
+TimedClient wraps an SSLClient (or a BrokerClient) and records the duration of
+the connection and of each command. When the client exposes its requests
+session, the connection is split between the TCP and TLS handshakes, timed
+in the urllib3 connections of the session, and the authentication requests.
+The HTTP response hook splits each command between the request (until the
+response headers) and the response body.
+'''
+
+import json
+import os
+import time
+
+from ansible.module_utils.sns_client import FILE_RE
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(os.path.expanduser(path))
+    except OSError:
+        return 0
+
+
+class TimedClient(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.start = time.time()
+        self.timings = {"connect": None, "auth": None, "modify": None, "commands": [], "total": None}
+        self._http = []
+        self._handshakes = []
+        self._hooked = False
+
+    def __getattr__(self, name):
+        # SRV_RET_* constants and other client attributes
+        return getattr(self.client, name)
+
+    def _hook(self, response, *args, **kwargs):
+        self._http.append(response.elapsed.total_seconds())
+
+    def _handshake(self, duration):
+        self._handshakes.append(duration)
+
+    def _hook_handshakes(self, session):
+        '''
+        times the connect() of the HTTPS connections created by the pool manager of the appliance
+        '''
+        try:
+            manager = session.get_adapter(self.client.baseurl).poolmanager
+            pool_class = manager.pool_classes_by_scheme['https']
+        except Exception:
+            # proxy, unknown adapter: the connection is not split
+            return
+        record = self._handshake
+
+        class TimedConnection(pool_class.ConnectionCls):
+            def connect(self):
+                start = time.time()
+                super(TimedConnection, self).connect()
+                record(time.time() - start)
+
+        class TimedPool(pool_class):
+            ConnectionCls = TimedConnection
+
+        manager.pool_classes_by_scheme = dict(manager.pool_classes_by_scheme, https=TimedPool)
+
+    def _attach(self):
+        session = getattr(self.client, 'session', None)
+        if self._hooked or session is None or not hasattr(session, 'hooks'):
+            return
+        session.hooks.setdefault('response', []).append(self._hook)
+        if not getattr(self.client, 'proxy', None):
+            self._hook_handshakes(session)
+        self._hooked = True
+
+    def connect(self):
+        self._attach()
+        self._handshakes = []
+        start = time.time()
+        self.client.connect()
+        duration = time.time() - start
+        if self._handshakes:
+            self.timings['connect'] = round(sum(self._handshakes), 6)
+            self.timings['auth'] = round(duration - sum(self._handshakes), 6)
+        else:
+            self.timings['connect'] = round(duration, 6)
+        self._attach()
+
+    def send_command(self, command):
+        self._http = []
+        entry = {"command": command, "bytes_sent": len(command)}
+        match = FILE_RE.match(command)
+        if match is not None and match.group(2) == '<':
+            entry['bytes_sent'] += _file_size(match.group(3))
+        start = time.time()
+        try:
+            response = self.client.send_command(command)
+        except Exception as exception:
+            entry['error'] = str(exception)
+            raise
+        finally:
+            duration = time.time() - start
+            entry['duration'] = round(duration, 6)
+            if self._http:
+                entry['send'] = round(sum(self._http), 6)
+                entry['receive'] = round(duration - sum(self._http), 6)
+            self.timings['commands'].append(entry)
+            if " ".join(command.split()).upper().startswith("MODIFY "):
+                self.timings['modify'] = round((self.timings['modify'] or 0) + duration, 6)
+        entry['ret'] = response.ret
+        entry['bytes_received'] = len(response.output)
+        if match is not None and match.group(2) == '>':
+            entry['bytes_received'] += _file_size(match.group(3))
+        return response
+
+    def disconnect(self):
+        self.client.disconnect()
+
+    def result(self):
+        '''
+        returns the timings with the total duration since the client creation
+        '''
+        self.timings['total'] = round(time.time() - self.start, 6)
+        return self.timings
+
+
+def write_trace(path, record):
+    '''
+    appends a JSON line to the trace file
+    '''
+    line = (json.dumps(record, sort_keys=True) + "\n").encode('utf-8')
+    fd = os.open(os.path.expanduser(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)